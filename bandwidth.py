@@ -4,9 +4,11 @@
 """Bandwidth measurement application.
 
 usage:
-bandwidth <filename> <type>
+bandwidth [--fit] [--cache] <filename> [<filename> ...] <type>
 
-type: s11, s21\
+type: s11, s21
+--fit: fit the resonance circle instead of using the raw sample positions
+--cache: keep parsed traces in .npy files next to the data for later runs\
 """
 from __future__ import print_function
 from __future__ import division
@@ -14,74 +16,294 @@ import numpy as np
 import matplotlib.pyplot as plt
 import cmath
 import sys
+import time
+from multiprocessing import Pool
+from traceloader import load_trace, TraceCache
+import metrics
 
+# Result of the bandwidth calculation, one record per trace
+RESULT_DTYPE = np.dtype([('peak_freq', float), ('freq_imag_min', float),
+                         ('freq_imag_max', float), ('bandwidth', float),
+                         ('q', float), ('q_unloaded', float)])
 
-def trace_process(data, s11=True, plot=True):
+
+def batch_process(traces, s11=True, chunk_size=256, engine="peak"):
+    """Calculate bandwidth and Q for a stack of VNA traces at once.
+
+    traces has shape (n_traces, n_points, 3) with columns freq (Hz),
+    mag (dB), phase (deg), all traces on their own frequency axis. The
+    input is only read. Traces are handled chunk_size at a time to bound
+    the size of the temporaries. Returns a structured array of
+    RESULT_DTYPE with one record per trace.
+
+    engine "peak" takes the extrema of the imaginary part at the sample
+    positions, so the result is limited to the frequency step. engine
+    "fit" uses circle_fit, which also gives the unloaded Q.
+    """
+    traces = np.asarray(traces)
+    if traces.ndim == 2:
+        traces = traces[np.newaxis]
+    result = np.zeros(len(traces), dtype=RESULT_DTYPE)
+    for start in range(0, len(traces), chunk_size):
+        chunk = traces[start:start + chunk_size]
+        if engine == "fit":
+            result[start:start + chunk_size] = circle_fit(chunk, s11)
+            continue
+        elif engine != "peak":
+            raise ValueError("Unknown engine " + str(engine))
+        rows = np.arange(len(chunk))
+        freq, mag_db, phase = chunk[:, :, 0], chunk[:, :, 1], chunk[:, :, 2]
+        if s11:
+            peak = np.argmin(mag_db, axis=1)
+        else:
+            peak = np.argmax(mag_db, axis=1)
+        # phase relative to the peak in radians, linear magnitude
+        phase_rad = np.radians(phase - phase[rows, peak][:, np.newaxis])
+        imaginary_part = 10 ** (mag_db / 20) * np.sin(phase_rad)
+        out = result[start:start + chunk_size]
+        out['peak_freq'] = freq[rows, peak]
+        out['freq_imag_min'] = freq[rows, np.argmin(imaginary_part, axis=1)]
+        out['freq_imag_max'] = freq[rows, np.argmax(imaginary_part, axis=1)]
+        out['bandwidth'] = np.abs(out['freq_imag_max'] - out['freq_imag_min'])
+        with np.errstate(divide='ignore'):
+            out['q'] = out['peak_freq'] / out['bandwidth']
+        out['q_unloaded'] = np.nan
+    return result
+
+
+def circle_fit(traces, s11=True):
+    """Least squares resonance fit for a stack of traces.
+
+    Near a resonance S(f) traces a circle in the complex plane, which is
+    the bilinear function S = (a f + b) / (c f + 1). Multiplying out gives
+    a f + b - c f S = S, linear in a, b, c, so all traces are solved at
+    once through their 3x3 normal equations. The pole f = -1/c is
+    f0 + j f0 / (2 QL). The circle diameter relative to the off resonance
+    point S(inf) = a / c gives the coupling, from which the unloaded Q
+    follows: QL (1 + beta) for reflection, QL / (1 - |S21(f0)|) for
+    transmission.
+    """
+    freq = traces[:, :, 0]
+    s = 10 ** (traces[:, :, 1] / 20) * np.exp(1j * np.radians(traces[:, :, 2]))
+    # normalised frequency keeps the normal equations well conditioned
+    centre = freq.mean(axis=1, keepdims=True)
+    scale = np.ptp(freq, axis=1, keepdims=True) / 2
+    x = (freq - centre) / scale
+    design = np.stack([x, np.ones_like(x), -x * s], axis=2)
+    normal = np.einsum('tpi,tpj->tij', design.conj(), design)
+    rhs = np.einsum('tpi,tp->ti', design.conj(), s)
+    a, b, c = np.linalg.solve(normal, rhs[:, :, np.newaxis])[:, :, 0].T
+
+    pole = centre[:, 0] + scale[:, 0] * (-1 / c)
+    f0 = pole.real
+    half_bandwidth = np.abs(pole.imag)
+    s_inf = a / c
+    s_f0 = (a * (f0 - centre[:, 0]) / scale[:, 0] + b) / (c * (f0 - centre[:, 0]) / scale[:, 0] + 1)
+
+    result = np.zeros(len(traces), dtype=RESULT_DTYPE)
+    result['peak_freq'] = f0
+    result['freq_imag_min'] = f0 - half_bandwidth
+    result['freq_imag_max'] = f0 + half_bandwidth
+    result['bandwidth'] = 2 * half_bandwidth
+    result['q'] = f0 / result['bandwidth']
+    if s11:
+        diameter = np.abs(s_f0 - s_inf) / np.abs(s_inf)
+        beta = diameter / (2 - diameter)
+        result['q_unloaded'] = result['q'] * (1 + beta)
+    else:
+        result['q_unloaded'] = result['q'] / (1 - np.abs(s_f0))
+    return result
+
+
+class QTracker:
+    """Follow a drifting resonance sweep by sweep.
+
+    Only a window of window points around the previous resonance is
+    evaluated, and the window moves with the resonance. Running mean and
+    standard deviation of f0 and Q and the drift rate of f0 (Hz/s, least
+    squares slope) are updated without keeping any history.
+
+    By default update() takes arrays as returned by
+    NetworkAnalyser.get_data: freq (MHz), Re, Im. Use layout="db" and
+    freq_scale=1 for the freq (Hz), mag (dB), phase (deg) layout of
+    trace_process.
+    """
+
+    def __init__(self, window=101, s11=True, engine="fit", layout="ri", freq_scale=1e6):
+        self.window = window
+        self.s11 = s11
+        self.engine = engine
+        self.layout = layout
+        self.freq_scale = freq_scale
+        self.index = None  # sample index of the last resonance
+        self.count = 0
+        self.t0 = None
+        self.f0_mean = self.f0_m2 = 0.
+        self.q_mean = self.q_m2 = 0.
+        self.t_mean = self.t_m2 = self.tf_c = 0.
+
+    def to_db_layout(self, data):
+        if self.layout == "db":
+            return data
+        trace = np.empty((len(data), 3))
+        s = data[:, 1] + 1j * data[:, 2]
+        trace[:, 0] = data[:, 0] * self.freq_scale
+        trace[:, 1] = 20 * np.log10(np.abs(s))
+        trace[:, 2] = np.degrees(np.angle(s))
+        return trace
+
+    def locate(self, data):
+        """Index of the resonance from a full scan, used for the first sweep or when the window lost it."""
+        if self.layout == "db":
+            magnitude = data[:, 1]
+        else:
+            magnitude = np.hypot(data[:, 1], data[:, 2])
+        return int(np.argmin(magnitude) if self.s11 else np.argmax(magnitude))
+
+    def evaluate(self, data, index):
+        lo = max(0, min(index - self.window // 2, len(data) - self.window))
+        window = self.to_db_layout(data[lo:lo + self.window])
+        result = batch_process(window, self.s11, engine=self.engine)[0]
+        inside = window[0, 0] <= result['peak_freq'] <= window[-1, 0]
+        # re-center on the window's own frequencies, never on the whole sweep
+        offset = np.clip(np.searchsorted(window[:, 0], result['peak_freq']), 0, len(window) - 1)
+        return result, inside, lo + int(offset)
+
+    def update(self, data, timestamp=None):
+        """Evaluate one sweep, returns its RESULT_DTYPE record."""
+        if self.index is None:
+            self.index = self.locate(data)
+        result, inside, index = self.evaluate(data, self.index)
+        if not inside:
+            result, inside, index = self.evaluate(data, self.locate(data))
+        self.index = index
+        self.add_statistics(result['peak_freq'], result['q'], timestamp)
+        return result
+
+    def add_statistics(self, f0, q, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        elif hasattr(timestamp, "timestamp"):
+            timestamp = timestamp.timestamp()
+        if self.t0 is None:
+            self.t0 = timestamp
+        t = timestamp - self.t0
+        self.count += 1
+        # Welford updates, tf_c is the co-moment of time and f0
+        delta_f = f0 - self.f0_mean
+        delta_t = t - self.t_mean
+        self.f0_mean += delta_f / self.count
+        self.t_mean += delta_t / self.count
+        self.f0_m2 += delta_f * (f0 - self.f0_mean)
+        self.t_m2 += delta_t * (t - self.t_mean)
+        self.tf_c += delta_t * (f0 - self.f0_mean)
+        delta_q = q - self.q_mean
+        self.q_mean += delta_q / self.count
+        self.q_m2 += delta_q * (q - self.q_mean)
+
+    @property
+    def f0_std(self):
+        return np.sqrt(self.f0_m2 / (self.count - 1)) if self.count > 1 else np.nan
+
+    @property
+    def q_std(self):
+        return np.sqrt(self.q_m2 / (self.count - 1)) if self.count > 1 else np.nan
+
+    @property
+    def drift_rate(self):
+        """Slope of f0 over time in Hz/s."""
+        return self.tf_c / self.t_m2 if self.t_m2 > 0 else np.nan
+
+
+@metrics.timed('bandwidth.trace_process')
+def trace_process(data, s11=True, plot=True, engine="peak"):
     """Calculate the bandwidth from VNA trace data."""
     # Columns of data are: freq (Hz), mag (dB), phase (deg)
+    result = batch_process(data, s11, engine=engine)[0]
+
+    # Data output
+    flag = "minimum" if s11 else "maximum"
+    print("Frequency at {}: {:d} Hz".format(flag, int(result['peak_freq'])))
+    print("Bandwidth {:.6f} kHz".format(result['bandwidth'] * 1e-3))
+    print("Q {:.0f}".format(result['q']))
+    if engine == "fit":
+        print("Unloaded Q {:.0f}".format(result['q_unloaded']))
+    if plot is False:
+        return result
     if s11:
         peak_freq = np.argmin(data[:, 1])
     else:
         peak_freq = np.argmax(data[:, 1])
-
-    phase_at_peak = data[peak_freq, 2]
-    # subtract phase from all measurements and convert to radians
-    data[:, 2] = (data[:, 2] - phase_at_peak)*np.pi*0.00555555555
-    # convert dB S11 to lin S11
-    data[:, 1] = 10 ** (data[:, 1] / 20)
-    # convert to complex and then to imaginary
-    imaginary_part = data[:, 1]*np.sin(data[:, 2])
-    # find max and min imaginary
-    freq_imag_min = data[np.argmin(imaginary_part), 0]
-    freq_imag_max = data[np.argmax(imaginary_part), 0]
-
-    # printing extras
-    format_string = "Frequency of imaginary {} {:d}"
-    flag = "minimum" if s11 else "maximum"
-    # Data output
-    print("Frequency at {}: {:d} Hz".format(flag, int(data[peak_freq, 0])))
-    #print(format_string.format("maximum", int(freq_imag_max)))
-    #print(format_string.format("minimum", int(freq_imag_min)))
-    bandwidth = abs(freq_imag_max - freq_imag_min)
-    print("Bandwidth {:.6f} kHz".format(bandwidth * 1e-3))
-    q = data[peak_freq, 0] / bandwidth
-    print("Q {:.0f}".format(q))
-    if plot is False:
-        return
+    # phase relative to the peak in radians, linear magnitude
+    phase = (data[:, 2] - data[peak_freq, 2])*np.pi*0.00555555555
+    magnitude = 10 ** (data[:, 1] / 20)
+    imaginary_part = magnitude*np.sin(phase)
     # Plots
     plt.figure(0, figsize=(8, 5))
     plt.plot(data[:, 0], imaginary_part)
     plt.title("Imaginary vs. frequency")
     plt.savefig("imag.png")
     plt.clf()
-    plt.polar(data[:, 2], data[:, 1])  # first phase, then r
-    plt.scatter(data[peak_freq, 2], data[peak_freq, 1], c='r', marker='o')
+    plt.polar(phase, magnitude)  # first phase, then r
+    plt.scatter(phase[peak_freq], magnitude[peak_freq], c='r', marker='o')
     plt.title("S11 in polar", va="bottom")
     plt.savefig("polar.png")
     plt.clf()
-    plt.plot(data[:, 0], data[:, 1])
+    plt.plot(data[:, 0], magnitude)
     plt.title("S11 curve in linear scale")
     plt.savefig("curve.png")
     plt.close("all")
+    return result
+
+
+def process_file(args):
+    """Load one trace file and calculate its bandwidth, for the process pool."""
+    filename, s11, engine, cache = args
+    data = load_trace(filename, cache)
+    return batch_process(data, s11, engine=engine)[0]
 
 
 def main():
-    if len(sys.argv) not in [2, 3]:
+    if len(sys.argv) < 2:
         print(__doc__)
         sys.exit(1)
-    filename = sys.argv[1]
-    s11_flag = None
-    try:
-        if sys.argv[2] == "s11":
-            s11_flag = True
-        elif sys.argv[2] == "s21":
-            s11_flag = False
-    except:
+    filenames = sys.argv[1:]
+    engine = "peak"
+    if "--fit" in filenames:
+        filenames.remove("--fit")
+        engine = "fit"
+    cache = None
+    if "--cache" in filenames:
+        filenames.remove("--cache")
+        cache = TraceCache()
+    if not filenames:
+        print(__doc__)
+        sys.exit(1)
+    s11_flag = True
+    if filenames[-1] in ["s11", "s21"]:
+        s11_flag = filenames.pop() == "s11"
+    else:
         print("Assuming S11")
-        s11_flag = True
+    if not filenames:
+        print(__doc__)
+        sys.exit(1)
 
-    data = np.loadtxt(filename, skiprows=5)  # it's 5,not 3, due to ^M
-    trace_process(data, s11_flag, False)
+    if len(filenames) == 1:
+        data = load_trace(filenames[0], cache)
+        trace_process(data, s11_flag, False, engine)
+        return
+
+    pool = Pool()
+    try:
+        results = pool.map(process_file, [(filename, s11_flag, engine, cache) for filename in filenames])
+    finally:
+        pool.close()
+        pool.join()
+    print("{}\t{}\t{}\t{}\t{}".format("filename", "peak freq [Hz]", "bandwidth [kHz]", "Q", "unloaded Q"))
+    for filename, result in zip(filenames, results):
+        print("{}\t{:d}\t{:.6f}\t{:.0f}\t{:.0f}".format(filename, int(result['peak_freq']),
+                                                       result['bandwidth'] * 1e-3, result['q'],
+                                                       result['q_unloaded']))
 
 
 if __name__ == "__main__":
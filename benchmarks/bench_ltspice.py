@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Throughput of the LTSpice export parser in ltspiceresultplot.py
+
+A synthetic .ac export is written and read with the old line by line
+parser and with read_export.
+
+usage:
+bench_ltspice [n_rows] [n_traces]
+
+"""
+
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import ltspiceresultplot
+
+
+def write_export(filename, n_rows, n_traces=1, seed=0):
+    """Write an .ac style export with n_traces complex traces in re,im format."""
+    rng = np.random.default_rng(seed)
+    freq = np.logspace(1, 9, n_rows)
+    values = rng.standard_normal((n_rows, 2 * n_traces))
+    names = '\t'.join('V(n{:03d})'.format(k + 1) for k in range(n_traces))
+    fmt = '%.14e' + '\t%.14e,%.14e' * n_traces
+    np.savetxt(filename, np.column_stack([freq, values]), fmt=fmt, header='Freq.\t' + names, comments='')
+
+
+def parse_lines(filename):
+    """The parser as it was before read_export, single trace only."""
+    dd = []
+    with open(filename) as f:
+        f.readline()
+        for line in f.readlines():
+            line = line.replace('\n', '')
+            line = line.replace('\t', ',')
+            line = line.split(',')
+            dd.append([float(line[0]), float(line[1]), float(line[2])])
+    return np.array(dd)
+
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    n_traces = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    filename = os.path.join(tempfile.mkdtemp(), 'export.txt')
+    write_export(filename, n_rows, n_traces)
+    megabytes = os.path.getsize(filename) / 1e6
+
+    start = time.perf_counter()
+    names, new = ltspiceresultplot.read_export(filename)
+    t_new = time.perf_counter() - start
+    print('read_export  {:8.2f} s {:8.1f} MB/s'.format(t_new, megabytes / t_new))
+    if n_traces == 1:
+        start = time.perf_counter()
+        old = parse_lines(filename)
+        t_old = time.perf_counter() - start
+        print('line parser  {:8.2f} s {:8.1f} MB/s'.format(t_old, megabytes / t_old))
+        print('speed up     {:8.1f}'.format(t_old / t_new))
+        assert np.array_equal(old, new)
+    os.remove(filename)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Accuracy of the bandwidth.py Q engines vs. number of sweep points
+
+Synthetic S11 resonances with random centre frequency and noise are
+evaluated with the "peak" and the "fit" engine. For each point count the
+rms error of f0 and loaded Q and the time per trace are printed.
+
+usage:
+bench_qfit [n_traces]
+
+"""
+
+from __future__ import print_function, division
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import bandwidth
+
+
+def synthetic_s11(n_traces, n_points, f0=400e6, q_unloaded=5000., beta=0.8, span_bw=6.,
+                  noise=1e-3, seed=0):
+    """Stack of (n_traces, n_points, 3) S11 traces, freq (Hz), mag (dB), phase (deg).
+
+    Span is span_bw loaded bandwidths, the true centre is scattered by up
+    to half a bandwidth. Returns traces and the true f0 per trace.
+    """
+    rng = np.random.default_rng(seed)
+    q_loaded = q_unloaded / (1 + beta)
+    bw = f0 / q_loaded
+    freq = np.linspace(f0 - span_bw * bw / 2, f0 + span_bw * bw / 2, n_points)
+    true_f0 = f0 + rng.uniform(-bw / 2, bw / 2, n_traces)
+    delta = (freq[np.newaxis, :] - true_f0[:, np.newaxis]) / true_f0[:, np.newaxis]
+    s = (beta - 1 - 2j * q_unloaded * delta) / (beta + 1 + 2j * q_unloaded * delta)
+    s = s + noise * (rng.standard_normal(s.shape) + 1j * rng.standard_normal(s.shape))
+    traces = np.empty((n_traces, n_points, 3))
+    traces[:, :, 0] = freq
+    traces[:, :, 1] = 20 * np.log10(np.abs(s))
+    traces[:, :, 2] = np.degrees(np.angle(s))
+    return traces, true_f0, q_loaded, q_unloaded
+
+
+def main():
+    n_traces = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    print('{:>8} {:>6} {:>14} {:>12} {:>12} {:>14}'.format(
+        'points', 'engine', 'f0 rms [Hz]', 'QL err [%]', 'Q0 err [%]', 'us per trace'))
+    for n_points in [21, 51, 101, 201, 401, 1001, 4001]:
+        traces, true_f0, q_loaded, q_unloaded = synthetic_s11(n_traces, n_points)
+        for engine in ['peak', 'fit']:
+            start = time.perf_counter()
+            result = bandwidth.batch_process(traces, s11=True, engine=engine)
+            elapsed = time.perf_counter() - start
+            f0_rms = np.sqrt(np.mean((result['peak_freq'] - true_f0) ** 2))
+            ql_err = 100 * np.sqrt(np.mean((result['q'] / q_loaded - 1) ** 2))
+            q0_err = 100 * np.sqrt(np.mean((result['q_unloaded'] / q_unloaded - 1) ** 2))
+            print('{:>8} {:>6} {:>14.1f} {:>12.2f} {:>12.2f} {:>14.1f}'.format(
+                n_points, engine, f0_rms, ql_err, q0_err, elapsed / n_traces * 1e6))
+
+
+if __name__ == '__main__':
+    main()
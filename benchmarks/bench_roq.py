@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+R/Q calculation of mwstools.RoQ, vectorized vs. the former double loop
+
+A synthetic TM010 like field on an (nz, ny, nx) grid is integrated with the
+loop over (x, y) that get_roq used before, and with the vectorized get_roq
+in float64, float32 and with z slabs.
+
+usage:
+bench_roq [nx] [ny] [nz]
+
+"""
+
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import mwstools
+
+
+def synthetic_grid(nx, ny, nz, step=0.1):
+    """Flat x, y, z, |E| columns in MWS order (x fastest), coordinates in cm."""
+    x = (np.arange(nx) - nx // 2) * step
+    y = (np.arange(ny) - ny // 2) * step
+    z = np.arange(nz) * step
+    zz, yy, xx = np.meshgrid(z, y, x, indexing='ij')
+    radius = max(x[-1], y[-1], step)
+    e_field = 1e6 * np.exp(-(xx ** 2 + yy ** 2) / radius ** 2) * np.sin(np.pi * zz / (z[-1] or 1))
+    return xx.ravel(), yy.ravel(), zz.ravel(), e_field.ravel()
+
+
+def roq_loop(roq):
+    """get_roq as it was, one trapezoid per (x, y) column."""
+    result = np.zeros((roq.xnum, roq.ynum))
+    for i in range(roq.xnum):
+        for j in range(roq.ynum):
+            result[i, j] = mwstools.trapezoid(roq.e_field[:, j, i], roq.z[:, j, i])
+    return (result ** 2 / roq.f0 / 2 / np.pi / 1e4).T
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def main():
+    nx, ny, nz = [int(arg) for arg in sys.argv[1:4]] if len(sys.argv) > 3 else (120, 120, 200)
+    step = 0.1
+    x, y, z, e_field = synthetic_grid(nx, ny, nz, step)
+    print('grid {} x {} x {} = {} points'.format(nx, ny, nz, nx * ny * nz))
+    roq = mwstools.RoQ.from_arrays(x, y, z, e_field, 1e9, step)
+    field = roq.e_field
+    reference, t_loop = timed(lambda: roq_loop(roq))
+    print('{:<20} {:8.3f} s'.format('loop', t_loop))
+    for label, dtype, slab_size in [('vectorized float64', float, None),
+                                    ('vectorized float32', np.float32, None),
+                                    ('slabs of 16 planes', float, 16)]:
+        roq.dtype, roq.slab_size = dtype, slab_size
+        roq.e_field = field.astype(dtype)
+        result, elapsed = timed(roq.get_roq)
+        error = np.max(np.abs(result - reference) / np.max(reference))
+        print('{:<20} {:8.3f} s  speed up {:6.1f}  max rel. deviation {:.1e}'.format(
+            label, elapsed, t_loop / elapsed, error))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite for the tools of the repository on synthetic data
+
+Every tool gets deterministic input in its file format at a chosen size:
+ZVL sweeps for bandwidth.py, MWS field grids for mwstools.RoQ, LTSpice
+exports, MWS parametric text for mws2cols.py and spectrum analyzer
+traces for specanbatch.py / spectrogram.py. The parse, compute and write
+stages are timed separately (best of --repeat runs) and their peak
+Python memory is measured with tracemalloc in an extra run. The vna
+benchmark runs NetworkAnalyser against a local fakevna.FakeVNA and
+measures the transfer throughput in ASCII and binary format.
+
+Results can be stored as a JSON baseline and compared with a later run,
+stages that got slower by more than --tolerance are reported and make
+the exit code 1:
+
+    bench_suite --save baseline.json
+    bench_suite --compare baseline.json
+
+usage:
+bench_suite [--size small|medium|large] [--only zvl,roq,ltspice,mws2cols,specan,vna]
+            [--repeat n] [--save <json>] [--compare <json>] [--tolerance 0.2]
+
+"""
+
+import os
+import sys
+import time
+import json
+import shutil
+import platform
+import tempfile
+import datetime
+import tracemalloc
+import numpy as np
+
+os.environ.setdefault('MPLBACKEND', 'Agg')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import bandwidth
+import traceloader
+import sweeparchive
+import mwstools
+import mws2cols
+import ltspiceresultplot
+import specanbatch
+import spectrogram
+import fakevna
+import networkanalyzer
+from bench_qfit import synthetic_s11
+from bench_roq import synthetic_grid
+from bench_ltspice import write_export
+
+SIZES = {
+    'small': {'zvl': (20, 4001), 'roq': (40, 40, 60), 'ltspice': (100000, 2), 'mws2cols': (200, 50),
+              'specan': (50, 4096), 'vna': (20, 4001)},
+    'medium': {'zvl': (200, 4001), 'roq': (100, 100, 150), 'ltspice': (1000000, 2), 'mws2cols': (2000, 100),
+               'specan': (500, 8192), 'vna': (100, 4001)},
+    'large': {'zvl': (1000, 20001), 'roq': (200, 200, 300), 'ltspice': (5000000, 4), 'mws2cols': (20000, 200),
+              'specan': (2000, 32768), 'vna': (200, 20001)},
+}
+
+
+def measure(function, repeat=3, memory=True):
+    """Best wall time of function over repeat runs and its peak traced memory in MB."""
+    seconds = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds = min(seconds, time.perf_counter() - start)
+    result = {'seconds': seconds}
+    if memory:
+        tracemalloc.start()
+        try:
+            function()
+            result['peak_mb'] = tracemalloc.get_traced_memory()[1] / 1e6
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def throughput(result, megabytes=None, items=None, unit='items'):
+    if megabytes is not None:
+        result['mb_per_s'] = megabytes / result['seconds']
+    if items is not None:
+        result[unit + '_per_s'] = items / result['seconds']
+    return result
+
+
+# ---------- generators
+
+
+def write_zvl_sweeps(directory, n_files, n_points, seed=0):
+    """ZVL exports with freq (Hz), mag (dB), phase (deg) columns as bandwidth.py reads them."""
+    traces, _, _, _ = synthetic_s11(n_files, n_points, seed=seed)
+    filenames = []
+    for k, trace in enumerate(traces):
+        filename = os.path.join(directory, 'sweep{:05d}.dat'.format(k))
+        np.savetxt(filename, trace, header='freq[Hz];dB;deg', delimiter=';')
+        filenames.append(filename)
+    return filenames
+
+
+def write_field_export(filename, nx, ny, nz):
+    """MWS field export, two header lines, x y z and three field columns, |E| in column 5."""
+    x, y, z, e_field = synthetic_grid(nx, ny, nz)
+    zeros = np.zeros_like(e_field)
+    np.savetxt(filename, np.column_stack([x, y, z, zeros, zeros, e_field]), fmt='%.6e',
+               header='x [cm] y [cm] z [cm] ExRe EyRe EzRe\n' + '-' * 60, comments='')
+
+
+def write_parametric(filename, n_runs, n_modes, seed=0):
+    """MWS multi parametric R/Q export, one block of mode number and R/Q per run."""
+    rng = np.random.default_rng(seed)
+    with open(filename, 'w') as f:
+        f.write('Parametric R/Q export\n')
+        for run in range(1, n_runs + 1):
+            f.write('\nMode Number\tR/Q [Ohm] (run {})\n'.format(run))
+            modes = np.arange(1, n_modes + 1)
+            np.savetxt(f, np.column_stack([modes, rng.uniform(0.1, 100, n_modes)]), fmt=['%d', '%.8e'],
+                       delimiter='\t')
+
+
+def write_specan_traces(directory, n_traces, n_points, seed=0):
+    """Spectrum analyzer traces as freq;power text, with increasing modification times."""
+    rng = np.random.default_rng(seed)
+    ff = np.linspace(244e6, 246e6, n_points)
+    filenames = []
+    for k in range(n_traces):
+        pp = -90 + 3 * rng.standard_normal(n_points) + 40 * np.exp(-((ff - 245e6 - k * 1e3) / 2e4) ** 2)
+        filename = os.path.join(directory, 'trace{:05d}.specan'.format(k))
+        np.savetxt(filename, np.column_stack([ff, pp]), delimiter=';', header='x [Hz];y [dBm]')
+        os.utime(filename, (1e9 + k, 1e9 + k))
+        filenames.append(filename)
+    return filenames
+
+
+def read_specan_trace(filename):
+    """Reader for write_specan_traces in the form specanbatch.collect expects."""
+    data = traceloader.parse_text(filename)
+    return data[:, 0], data[:, 1], ['Hz', 'dBm']
+
+
+def total_megabytes(filenames):
+    return sum(os.path.getsize(filename) for filename in filenames) / 1e6
+
+
+# ---------- benchmarks, each returns {stage: result}
+
+
+def bench_zvl(directory, size, repeat):
+    n_files, n_points = size
+    filenames = write_zvl_sweeps(directory, n_files, n_points)
+    megabytes = total_megabytes(filenames)
+    traces = np.array([traceloader.parse_text(filename) for filename in filenames])
+    cache = traceloader.TraceCache(os.path.join(directory, 'cache'))
+    for filename in filenames:
+        traceloader.load_trace(filename, cache)
+    archive_name = os.path.join(directory, 'sweeps.swa')
+
+    def write():
+        if os.path.exists(archive_name):
+            os.remove(archive_name)
+        with sweeparchive.SweepArchive(archive_name, n_points=n_points) as archive:
+            for k, trace in enumerate(traces):
+                archive.append(trace, timestamp=float(k))
+
+    return {
+        'parse': throughput(measure(lambda: [traceloader.parse_text(f) for f in filenames], repeat), megabytes),
+        'parse_cached': throughput(measure(lambda: [np.array(traceloader.load_trace(f, cache)) for f in filenames],
+                                           repeat), megabytes),
+        'compute_peak': throughput(measure(lambda: bandwidth.batch_process(traces, engine='peak'), repeat),
+                                   items=n_files, unit='sweeps'),
+        'compute_fit': throughput(measure(lambda: bandwidth.batch_process(traces, engine='fit'), repeat),
+                                  items=n_files, unit='sweeps'),
+        'write': throughput(measure(write, repeat), traces.nbytes / 1e6),
+    }
+
+
+def bench_roq(directory, size, repeat):
+    nx, ny, nz = size
+    filename = os.path.join(directory, 'field.txt')
+    write_field_export(filename, nx, ny, nz)
+    megabytes = os.path.getsize(filename) / 1e6
+    grid = mwstools.load_field(filename, cache=True)  # leaves the .npy cache for parse_cached
+    roq = mwstools.RoQ(None, 1e9)
+
+    return {
+        'parse': throughput(measure(lambda: mwstools.load_field(filename, cache=False), repeat), megabytes),
+        'parse_cached': throughput(measure(lambda: np.array(mwstools.load_field(filename)[3]), repeat), megabytes),
+        'compute': throughput(measure(lambda: roq.setup(*grid), repeat), items=nx * ny * nz, unit='points'),
+        'write': measure(lambda: np.savez(os.path.join(directory, 'roq.npz'), roq=roq.roq, xs=roq.xs, ys=roq.ys),
+                         repeat),
+    }
+
+
+def bench_ltspice(directory, size, repeat):
+    n_rows, n_traces = size
+    filename = os.path.join(directory, 'export.txt')
+    write_export(filename, n_rows, n_traces)
+    megabytes = os.path.getsize(filename) / 1e6
+    _, dda = ltspiceresultplot.read_export(filename)
+
+    return {
+        'parse': throughput(measure(lambda: ltspiceresultplot.read_export(filename), repeat), megabytes),
+        'compute': throughput(measure(lambda: ltspiceresultplot.decimate(dda[:, 0], dda[:, 1::2]), repeat),
+                              items=n_rows, unit='rows'),
+        'write': measure(lambda: ltspiceresultplot.process(filename), 1),  # parse, decimate and two PNG files
+    }
+
+
+def bench_mws2cols(directory, size, repeat):
+    n_runs, n_modes = size
+    filename = os.path.join(directory, 'parametric.txt')
+    write_parametric(filename, n_runs, n_modes)
+    megabytes = os.path.getsize(filename) / 1e6
+
+    def parse():
+        with open(filename) as f:
+            return [mws2cols.parse(run) for run in mws2cols.iter_run_texts(f)]
+
+    return {
+        'parse': throughput(measure(parse, repeat), megabytes),
+        'compute': throughput(measure(lambda: mws2cols.to_array(filename), repeat), megabytes),
+        'write': throughput(measure(lambda: mws2cols.to_csv(filename, os.path.join(directory, 'out.csv')), repeat),
+                            megabytes),
+    }
+
+
+def bench_specan(directory, size, repeat):
+    n_traces, n_points = size
+    filenames = write_specan_traces(directory, n_traces, n_points)
+    megabytes = total_megabytes(filenames)
+    ff, power, times, units = specanbatch.collect(filenames, read_specan_trace)
+    store_dir = os.path.join(directory, 'store')
+
+    def write():
+        shutil.rmtree(store_dir, ignore_errors=True)
+        spectrogram.SpectrogramStore(store_dir).append(ff, power, times, units)
+
+    write()
+    store = spectrogram.SpectrogramStore(store_dir)
+    band = (ff[n_points // 2 - 50], ff[n_points // 2 + 50])
+
+    return {
+        'parse': throughput(measure(lambda: specanbatch.collect(filenames, read_specan_trace), repeat), megabytes),
+        'write': throughput(measure(write, repeat), power.nbytes / 2e6),  # stored as float32
+        'compute_band': throughput(measure(lambda: store.band(*band), repeat), items=n_traces, unit='traces'),
+    }
+
+
+def bench_vna(directory, size, repeat):
+    n_sweeps, n_points = size
+    result = {}
+    with fakevna.FakeVNA(n_points=n_points) as vna:
+        for data_format in ['ASCII', 'REAL,32', 'REAL,64']:
+            myvna = networkanalyzer.NetworkAnalyser('dummy.cal', vna.host, vna.port, n_points=n_points,
+                                                    data_format=data_format)
+            myvna.connect()
+            name = data_format.lower().replace(',', '')
+            result[name + '_transfer'] = throughput(
+                measure(lambda: [myvna.get_data() for _ in range(n_sweeps)], repeat, memory=False),
+                items=n_sweeps * n_points, unit='points')
+            myvna.sock.close()
+        data = myvna.get_frequencies()
+        data = np.column_stack([data, np.zeros((n_points, 2))])
+    filename = os.path.join(directory, 'sweep')
+    result['write'] = throughput(measure(lambda: myvna.save_to_file(filename, data), repeat), items=1, unit='sweeps')
+    return result
+
+
+BENCHMARKS = {
+    'zvl': bench_zvl,
+    'roq': bench_roq,
+    'ltspice': bench_ltspice,
+    'mws2cols': bench_mws2cols,
+    'specan': bench_specan,
+    'vna': bench_vna,
+}
+
+
+def run(names, size='small', repeat=3):
+    """Run the named benchmarks, returns the results as a JSON ready dict."""
+    results = {}
+    for name in names:
+        directory = tempfile.mkdtemp(prefix='bench_' + name)
+        try:
+            for stage, result in BENCHMARKS[name](directory, SIZES[size][name], repeat).items():
+                results['{}.{}'.format(name, stage)] = result
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return {'meta': {'date': datetime.datetime.now().isoformat(), 'size': size, 'sizes': SIZES[size],
+                     'python': platform.python_version(), 'numpy': np.__version__,
+                     'machine': platform.machine(), 'cpus': os.cpu_count()},
+            'results': results}
+
+
+def print_results(results):
+    print('{:<26} {:>10} {:>10} {:>16}'.format('stage', 'time [s]', 'peak [MB]', 'throughput'))
+    for key, result in results.items():
+        rates = ['{:.4g} {}'.format(value, name.replace('_per_s', '/s').replace('mb/', 'MB/'))
+                 for name, value in result.items() if name.endswith('_per_s')]
+        print('{:<26} {:>10.4f} {:>10} {:>16}'.format(key, result['seconds'],
+                                                      '{:.1f}'.format(result['peak_mb']) if 'peak_mb' in result else '-',
+                                                      ', '.join(rates)))
+
+
+def compare(baseline, current, tolerance=0.2):
+    """Print the time ratio of every stage in both runs, returns the stages slower than 1 + tolerance."""
+    if baseline['meta'].get('size') != current['meta'].get('size'):
+        print('Warning: baseline size {} differs from {}.'.format(baseline['meta'].get('size'),
+                                                                  current['meta'].get('size')))
+    print('{:<26} {:>10} {:>10} {:>8}'.format('stage', 'base [s]', 'now [s]', 'ratio'))
+    slower = []
+    for key, result in current['results'].items():
+        if key not in baseline['results']:
+            continue
+        old, new = baseline['results'][key]['seconds'], result['seconds']
+        ratio = new / old if old else np.inf
+        flag = ''
+        if ratio > 1 + tolerance:
+            slower.append(key)
+            flag = '  slower'
+        elif ratio < 1 - tolerance:
+            flag = '  faster'
+        print('{:<26} {:>10.4f} {:>10.4f} {:>8.2f}{}'.format(key, old, new, ratio, flag))
+    return slower
+
+
+def main():
+    args = sys.argv[1:]
+    size, names, repeat, save, baseline, tolerance = 'small', list(BENCHMARKS), 3, None, None, 0.2
+    while args:
+        arg = args.pop(0)
+        if arg == '--size':
+            size = args.pop(0)
+        elif arg == '--only':
+            names = args.pop(0).split(',')
+        elif arg == '--repeat':
+            repeat = int(args.pop(0))
+        elif arg == '--save':
+            save = args.pop(0)
+        elif arg == '--compare':
+            baseline = args.pop(0)
+        elif arg == '--tolerance':
+            tolerance = float(args.pop(0))
+        else:
+            print(__doc__)
+            sys.exit(1)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if size not in SIZES or unknown:
+        print(__doc__)
+        sys.exit(1)
+
+    current = run(names, size, repeat)
+    print_results(current['results'])
+    if save is not None:
+        with open(save, 'w') as f:
+            json.dump(current, f, indent=1)
+    if baseline is not None:
+        with open(baseline) as f:
+            slower = compare(json.load(f), current, tolerance)
+        if slower:
+            print('{} stages slower than the baseline.'.format(len(slower)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+AnalyserPool against several fakevna.FakeVNA servers
+
+Every server gets its own sweep delay. The instruments are swept through
+AnalyserPool.stream, so the wall time must be close to that of the
+slowest instrument and well below the sum of all of them. One server is
+switched off in the middle of the run: it has to end up in pool.errors
+while the others deliver all their sweeps. A dropped connection has to
+be restored without resetting the instrument. The script exits with 1 if
+a check fails.
+
+usage:
+check_pool [n_sweeps]
+
+"""
+
+import os
+import sys
+import time
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import fakevna
+from networkanalyzer import AnalyserPool, AsyncNetworkAnalyser
+
+DELAYS = [0.02, 0.05, 0.1]  # seconds per sweep of each instrument
+KILLED = 1  # index of the instrument that is switched off during the run
+N_POINTS = 401
+
+
+async def stream(servers, n_sweeps, kill_after=None, glitch=False):
+    """Stream n_sweeps from every server, returns the pool, sweeps per instrument and the wall time.
+
+    After kill_after sweeps instrument KILLED is switched off, or with
+    glitch only its connection is dropped.
+    """
+    pool = AnalyserPool([AsyncNetworkAnalyser('dummy.cal', server.host, port=server.port, n_points=N_POINTS,
+                                              data_format='REAL,32', timeout=5.0, retries=1)
+                         for server in servers])
+    await pool.connect()
+    counts = [0] * len(servers)
+    start = time.perf_counter()
+    async for timestamp, index, data in pool.stream(n_sweeps):
+        assert data.shape == (N_POINTS, 3)
+        counts[index] += 1
+        if kill_after is not None and index == KILLED and counts[index] == kill_after:
+            if glitch:
+                servers[KILLED].drop_connections()
+            else:
+                servers[KILLED].stop()
+    elapsed = time.perf_counter() - start
+    await pool.close()
+    return pool, counts, elapsed
+
+
+def check(condition, message):
+    print('{:<4} {}'.format('ok' if condition else 'FAIL', message))
+    return condition
+
+
+def main():
+    n_sweeps = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    passed = True
+
+    servers = [fakevna.FakeVNA(n_points=N_POINTS, delay=delay) for delay in DELAYS]
+    for server in servers:
+        server.start()
+    try:
+        pool, counts, elapsed = asyncio.run(stream(servers, n_sweeps))
+    finally:
+        for server in servers:
+            server.stop()
+    slowest, total = n_sweeps * max(DELAYS), n_sweeps * sum(DELAYS)
+    print('{} instruments, {} sweeps each: {:.2f} s, slowest alone {:.2f} s, one after the other {:.2f} s'.format(
+        len(DELAYS), n_sweeps, elapsed, slowest, total))
+    passed &= check(counts == [n_sweeps] * len(DELAYS), 'all sweeps received {}'.format(counts))
+    passed &= check(not pool.errors, 'no errors')
+    passed &= check(elapsed < slowest + 0.5 * (total - slowest), 'instruments are swept concurrently')
+
+    servers = [fakevna.FakeVNA(n_points=N_POINTS, delay=delay) for delay in DELAYS]
+    for server in servers:
+        server.start()
+    try:
+        pool, counts, elapsed = asyncio.run(stream(servers, n_sweeps, kill_after=n_sweeps // 4))
+    finally:
+        for server in servers:
+            server.stop()
+    print('instrument {} switched off after {} sweeps: {}'.format(KILLED, n_sweeps // 4, pool.errors))
+    passed &= check(list(pool.errors) == [KILLED], 'switched off instrument is in errors')
+    passed &= check(all(count == n_sweeps for index, count in enumerate(counts) if index != KILLED),
+                    'the others deliver all sweeps {}'.format(counts))
+
+    servers = [fakevna.FakeVNA(n_points=N_POINTS, delay=delay) for delay in DELAYS]
+    for server in servers:
+        server.start()
+    try:
+        pool, counts, elapsed = asyncio.run(stream(servers, n_sweeps, kill_after=n_sweeps // 4, glitch=True))
+    finally:
+        for server in servers:
+            server.stop()
+    passed &= check(counts == [n_sweeps] * len(DELAYS) and not pool.errors,
+                    'instrument {} reconnects after a network glitch {}'.format(KILLED, counts))
+    passed &= check(servers[KILLED].commands.count('*RST') == 1, 'and is not reset again')
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Fake SCPI server that behaves like the R&S ZVL as far as networkanalyzer.py
+is concerned. Useful for testing and timing the transfer code without
+hardware:
+
+    with FakeVNA() as vna:
+        myvna = NetworkAnalyser('dummy.cal', vna.host, vna.port)
+        myvna.connect()
+        data = myvna.get_data()
+
+The trace is a synthetic S11 resonance in real/imaginary format. Setting
+commands are only recorded, queries that the client uses are answered.
+Common commands with a root colon (:*OPC?) are rejected like on the
+instrument: they go to errors and get no answer.
+
+usage:
+fakevna [port]
+
+2026 Xaratustrah
+
+"""
+
+import sys
+import re
+import socket
+import threading
+import numpy as np
+
+number_pattern = re.compile(r'[-+]?\d+\.?\d*([eE][-+]?\d+)?')
+
+
+def resonance_s11(n_points, f0=0.5, q_loaded=50., beta=0.8):
+    """Reflection of a one port resonator on a normalised axis 0..1, complex."""
+    x = np.linspace(0, 1, n_points)
+    detune = 2 * q_loaded * (x - f0) / f0
+    return (beta - 1 - 1j * detune) / (beta + 1 + 1j * detune)
+
+
+class FakeVNA:
+    def __init__(self, host='127.0.0.1', port=0, n_points=4001, delay=0.0):
+        self.host = host
+        self.n_points = n_points
+        self.delay = delay  # seconds to sleep per sweep, mimics the instrument
+        self.data_format = 'ASCII'
+        self.commands = []
+        self.errors = []  # (code, message, command) like the SCPI error queue
+        self.esr = 128  # event status register, power on bit set until read or cleared
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.port = self.server.getsockname()[1]
+        self.thread = None
+        self.running = False
+        self.connections = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        self.server.listen(8)
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop listening and drop open connections, like an instrument that is switched off."""
+        self.running = False
+        for sock in [self.server] + self.connections:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+    def drop_connections(self):
+        """Break open connections but keep listening, like a network glitch."""
+        for conn in list(self.connections):
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def power_cycle(self):
+        """Forget the settings, the next *ESR? reports a power on event."""
+        self.esr = 128
+        self.drop_connections()
+
+    def serve(self):
+        while self.running:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                break
+            self.connections.append(conn)
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def handle(self, conn):
+        try:
+            with conn:
+                self.converse(conn)
+        finally:
+            self.connections.remove(conn)
+
+    def converse(self, conn):
+        buffer = b''
+        while self.running:
+            try:
+                chunk = conn.recv(65536)
+            except OSError:
+                break
+            if not chunk:
+                break
+            buffer += chunk
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                for command in line.decode('ascii').split(';'):
+                    reply = self.execute(command.strip())
+                    if reply is not None and self.running:
+                        try:
+                            conn.sendall(reply)
+                        except OSError:
+                            return
+
+    def execute(self, command):
+        """Record a command and return the reply bytes for queries."""
+        if not command:
+            return None
+        if command.startswith(':*'):
+            # common commands have no root, the instrument rejects them and does not answer
+            self.errors.append((-113, 'Undefined header', command))
+            return None
+        if command.startswith(':'):
+            command = command[1:]
+        self.commands.append(command)
+        upper = command.upper()
+        if upper.startswith('FORM') and not upper.startswith('FORM:'):
+            self.data_format = upper.split(None, 1)[1].replace(' ', '')
+        elif upper.startswith('SWE:POIN'):
+            self.n_points = int(number_pattern.search(command).group(0))
+        elif upper == '*OPC?':
+            return b'1\n'
+        elif upper in ('SYST:ERR?', 'SYSTEM:ERROR?'):
+            if not self.errors:
+                return b'0,"No error"\n'
+            code, message, _ = self.errors.pop(0)
+            return '{},"{}"\n'.format(code, message).encode('ascii')
+        elif upper == '*ESR?':
+            esr, self.esr = self.esr, 0
+            return '{}\n'.format(esr).encode('ascii')
+        elif upper == '*CLS':
+            self.esr = 0
+        elif upper == '*IDN?':
+            return b'Rohde&Schwarz,ZVL-6,000000/000,0.0\n'
+        elif upper.startswith('INIT') and not upper.startswith('INIT:'):
+            if self.delay:
+                threading.Event().wait(self.delay)
+        elif upper.startswith('CALC:DATA?'):
+            return self.trace_reply()
+        return None
+
+    def trace_reply(self):
+        s11 = resonance_s11(self.n_points)
+        values = np.empty(2 * self.n_points)
+        values[0::2] = s11.real
+        values[1::2] = s11.imag
+        if self.data_format == 'ASCII':
+            return ','.join('{:.9e}'.format(v) for v in values).encode('ascii') + b'\n'
+        dtype = '<f8' if self.data_format.endswith('64') else '<f4'
+        payload = values.astype(dtype).tobytes()
+        length = str(len(payload)).encode('ascii')
+        return b'#' + str(len(length)).encode('ascii') + length + payload + b'\n'
+
+
+# ------------------------
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 5025
+    vna = FakeVNA(host='0.0.0.0', port=port)
+    vna.start()
+    print('Fake VNA listening on port {}'.format(vna.port))
+    try:
+        vna.thread.join()
+    except KeyboardInterrupt:
+        vna.stop()
@@ -25,53 +25,268 @@ Freq.	V(n001)
 ...
 
 
+Several traces (V(n001), V(n002), ...) in one export are supported, as is the
+polar format (-1.2dB,45.0°), which is read as magnitude in dB and phase in
+degrees.
+
+The native binary .raw files of LTSpice can be plotted directly, without the
+export tool. They are memory mapped, so single variables or a range of the
+time or frequency axis can be read from very large simulations:
+
+raw = RawFile('circuit.raw')
+vout = raw.get('V(out)')
+freq, vout = raw.window(1e3, 1e6, 'V(out)')
+
+Traces are decimated before plotting, keeping minimum and maximum per bin on
+the log frequency axis. Several files or directories are rendered in parallel:
+
+ltspiceresultplot.py <file or directory> [<file or directory> ...]
+
 2022 Xaratustrah
 
 """
 
 import sys
 import os
+from multiprocessing import Pool
 import numpy as np
 import matplotlib.pyplot as plt
+from traceloader import CHUNK_SIZE, iter_blocks, count_lines
+
+separator_table = bytes.maketrans(b'\t,\r', b'   ')
+polar_characters = b'()\xb0\xc2'  # brackets and the degree sign in latin-1 or utf-8
+
+
+def read_export(filename, chunk_size=CHUNK_SIZE):
+    """Read an LTSpice data export into a float array.
+
+    Returns the trace names from the header and an array with the x axis
+    in column 0, followed by one column per real trace or two (re, im or
+    dB, deg) per complex trace. Rows are counted first, then the text is
+    converted block by block straight into the preallocated array.
+    """
+    with open(filename, 'rb') as f:
+        names = f.readline().decode('latin-1').split()[1:]
+        data_start = f.tell()
+        first = clean(f.readline()).split()
+        if not first:
+            return names, np.zeros((0, len(names) + 1))
+        n_columns = len(first)
+        f.seek(data_start)
+        dda = np.empty((count_lines(f, chunk_size), n_columns))
+        flat = dda.reshape(-1)
+        position = 0
+        for block in iter_blocks(f, chunk_size):
+            values = np.fromstring(clean(block), sep=' ')
+            flat[position:position + len(values)] = values
+            position += len(values)
+    if position % n_columns:
+        raise ValueError('{}: incomplete row in export.'.format(filename))
+    return names, dda[:position // n_columns]
+
+
+def clean(block):
+    """Reduce export text to numbers separated by white space."""
+    if b'(' in block:
+        block = block.replace(b'dB', b'').translate(None, polar_characters)
+    return block.translate(separator_table).decode('ascii')
+
+
+class RawFile:
+    """Binary LTSpice .raw file, real (.tran, .op, .dc) or complex (.ac, FFT), normal or fastaccess layout."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        header, offset = self.read_header(filename)
+        self.title = header.get('Title', '')
+        self.plotname = header.get('Plotname', '')
+        self.flags = header.get('Flags', '').split()
+        self.n_points = int(header['No. Points'])
+        self.variables = [line.split()[1] for line in header['Variables']]
+        self.complex = 'complex' in self.flags
+        if self.complex:
+            dtype = [(name, '<c16') for name in self.variables]
+        elif 'double' in self.flags:
+            dtype = [(name, '<f8') for name in self.variables]
+        else:  # the axis is double, all other variables single precision
+            dtype = [(self.variables[0], '<f8')] + [(name, '<f4') for name in self.variables[1:]]
+        if 'fastaccess' in self.flags:
+            # stored variable by variable, each one is a contiguous block
+            self.data = {}
+            for name, variable_dtype in dtype:
+                self.data[name] = np.memmap(filename, dtype=variable_dtype, mode='r', offset=offset,
+                                            shape=(self.n_points,))
+                offset += np.dtype(variable_dtype).itemsize * self.n_points
+        else:
+            self.data = np.memmap(filename, dtype=np.dtype(dtype), mode='r', offset=offset, shape=(self.n_points,))
+
+    @staticmethod
+    def read_header(filename):
+        """Header fields as dict and the byte offset of the binary block."""
+        with open(filename, 'rb') as f:
+            start = f.read(2)
+            utf16 = len(start) == 2 and start[1:] == b'\0'  # LTSpice XVII writes UTF-16LE
+            encoding, width = ('utf-16-le', 2) if utf16 else ('latin-1', 1)
+            f.seek(0)
+            header = {}
+            offset = 0
+            key = None
+            line = b''
+            while True:
+                char = f.read(width)
+                if not char:
+                    raise ValueError('{}: no binary data found.'.format(filename))
+                offset += width
+                line += char
+                if char.decode(encoding) != '\n':
+                    continue
+                text = line.decode(encoding).rstrip()
+                line = b''
+                if text.startswith('Binary:'):
+                    return header, offset
+                if text.startswith('Values:'):
+                    raise ValueError('{}: ASCII .raw files are not supported.'.format(filename))
+                if key == 'Variables' and text[:1].isspace():
+                    header[key].append(text)
+                    continue
+                key, _, value = text.partition(':')
+                header[key] = [] if key == 'Variables' else value.strip()
+
+    def get(self, name, start=None, stop=None):
+        """Samples start:stop of one variable. Reads only that part of the file."""
+        values = self.data[name][start:stop]
+        if name == self.variables[0]:
+            # the sign of the time axis is used as a flag by LTSpice
+            values = np.abs(values.real) if not self.complex else values.real
+        return np.asarray(values)
 
+    def axis(self):
+        return self.get(self.variables[0])
 
-def process(filename):
+    def window(self, lo, hi, name):
+        """Axis and one variable for lo <= axis <= hi, the axis is searched, not loaded twice."""
+        axis = self.axis()
+        start = np.searchsorted(axis, lo, side='left')
+        stop = np.searchsorted(axis, hi, side='right')
+        return axis[start:stop], self.get(name, start, stop)
+
+    def to_columns(self, names=None):
+        """Array in the layout of read_export: axis, then re, im per complex or one column per real trace."""
+        names = names or self.variables[1:]
+        columns = [self.axis()]
+        for name in names:
+            values = self.get(name)
+            if self.complex:
+                columns += [values.real, values.imag]
+            else:
+                columns.append(values)
+        return names, np.column_stack(columns)
+
+
+def decimate(x, ys, n_bins=2000, log=True):
+    """Indices of the samples to plot, keeping the minimum and maximum of every column of ys per bin.
+
+    The x axis is cut into n_bins bins, equally spaced in log10(x) if log
+    is set, so peaks and notches survive at every scale. x must be sorted.
+    Non positive x cannot be shown on a log axis and is dropped.
+    """
+    if log:
+        valid = np.flatnonzero(x > 0)
+        position = np.log10(x[valid])
+    else:
+        valid = np.arange(len(x))
+        position = x
+    if len(valid) <= 2 * n_bins:
+        return valid
+    edges = np.linspace(position[0], position[-1], n_bins + 1)
+    bins = np.clip(np.searchsorted(edges, position, side='right') - 1, 0, n_bins - 1)
+    starts = np.flatnonzero(np.diff(bins, prepend=-1))
+    ends = np.append(starts[1:], len(bins)) - 1
+    keep = [starts, ends]
+    for y in np.atleast_2d(ys.T):
+        order = np.lexsort((y[valid], bins))  # sorted by bin, then by value
+        keep += [order[starts], order[ends]]
+    return valid[np.unique(np.concatenate(keep))]
+
+
+def process(filename, variables=None, n_bins=2000):
+    """Plot magnitude and, for complex data, phase of an export or .raw file, decimated to about 4 n_bins points per trace."""
     filename_base = os.path.basename(filename)
     filename_wo_ext = os.path.splitext(filename)[0]
 
-    dd = []
-    with open(filename) as f:
-        f.readline()
-        for line in f.readlines():
-            line = line.replace('\n', '')
-            line = line.replace('\t', ',')
-            line = line.split(',')
-            dd.append([float(line[0]), float(line[1]), float(line[2])])
+    if filename.lower().endswith('.raw'):
+        names, dda = RawFile(filename).to_columns(variables)
+    else:
+        names, dda = read_export(filename)
+    n_traces = len(names)
+    step = (dda.shape[1] - 1) // max(n_traces, 1)
 
-    dda = np.array(dd)
-
-    plt.plot(dda[:, 0], dda[:, 1], 'r')
+    magnitude = dda[:, 1::step]
+    keep = decimate(dda[:, 0], magnitude, n_bins) if n_bins else slice(None)
+    for k in range(n_traces):
+        plt.plot(dda[keep, 0], magnitude[keep, k], color='r' if n_traces == 1 else None, label=names[k])
     plt.xscale('log')
     plt.grid()
     plt.ylabel('Magnitude')
+    if n_traces > 1:
+        plt.legend()
     plt.xlabel('Freq.')
     plt.savefig(filename_wo_ext + '_mag.png')
 
     plt.clf()
 
-    plt.plot(dda[:, 0], dda[:, 2])
+    if step != 2:  # real data, there is no phase to plot
+        return dda
+
+    phase = dda[:, 2::step]
+    keep = decimate(dda[:, 0], phase, n_bins) if n_bins else slice(None)
+    for k in range(n_traces):
+        plt.plot(dda[keep, 0], phase[keep, k], label=names[k])
     plt.xscale('log')
     plt.grid()
     plt.ylabel('Phase')
+    if n_traces > 1:
+        plt.legend()
     plt.xlabel('Freq.')
     plt.savefig(filename_wo_ext + '_phase.png')
 
+    plt.clf()
+
     return dda
 
 
+def init_worker():
+    """Each worker renders off screen into one figure that is reused for all its files."""
+    plt.switch_backend('Agg')
+    plt.figure()
+
+
+def render(filename):
+    process(filename)
+    return filename
+
+
+def expand(paths):
+    """Files to render, directories are searched for exports and .raw files."""
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames += sorted(os.path.join(path, name) for name in os.listdir(path)
+                                if os.path.splitext(name)[1].lower() in ('.txt', '.raw'))
+        else:
+            filenames.append(path)
+    return filenames
+
+
 def main():
-    for file in sys.argv[1:]:
-        process(file)
+    filenames = expand(sys.argv[1:])
+    if len(filenames) < 2:
+        for file in filenames:
+            process(file)
+        return
+    with Pool(initializer=init_worker) as pool:
+        for file in pool.imap_unordered(render, filenames):
+            print(file)
 
 
 # ------------------------
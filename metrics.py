@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Opt-in timing spans and counters for the acquisition and analysis code
+
+Metrics are off by default. In that mode span() hands out one shared
+context that does nothing, and count() and timed functions return
+straight away, so the instrumented code runs at almost full speed.
+Switch them on in a script:
+
+    import metrics
+    metrics.enable()
+    ...
+    print(metrics.summary())
+    metrics.dump('metrics.jsonl')
+
+or without touching the code by setting MWSUITE_METRICS=<filename>, then
+the metrics of the run are appended to that file as one JSON line when
+the process exits.
+
+Spans: vna.connect, vna.sweep_wait, vna.transfer, vna.save,
+bandwidth.trace_process, roq.get_roq
+Counters: vna.bytes_received, vna.sweeps, vna.points, roq.points
+
+Only the process that enabled the metrics is measured, work done in Pool
+workers is not collected.
+
+usage:
+metrics <filename.jsonl>    summary table of every run in the file
+
+2026 Xaratustrah
+
+"""
+
+import sys
+import os
+import time
+import json
+import atexit
+import datetime
+import functools
+import threading
+import collections
+import numpy as np
+
+ENV_VARIABLE = 'MWSUITE_METRICS'
+
+_enabled = False
+_lock = threading.Lock()
+_spans = collections.defaultdict(list)
+_counters = collections.Counter()
+_started = time.time()
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def enable(reset_first=True):
+    global _enabled
+    if reset_first:
+        reset()
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    global _started
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        _started = time.time()
+
+
+def span(name):
+    """Context that times its block under name, a shared no-op if metrics are off."""
+    if not _enabled:
+        return NULL_SPAN
+    return Span(name)
+
+
+def timed(name):
+    """Decorator that times every call of a function under name."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with Span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record(name, seconds):
+    with _lock:
+        _spans[name].append(seconds)
+
+
+def count(name, value=1):
+    if _enabled:
+        with _lock:
+            _counters[name] += value
+
+
+def span_statistics(durations):
+    durations = np.asarray(durations)
+    p50, p90, p99 = np.percentile(durations, [50, 90, 99])
+    return {'count': len(durations), 'total': float(durations.sum()), 'mean': float(durations.mean()),
+            'min': float(durations.min()), 'p50': float(p50), 'p90': float(p90), 'p99': float(p99),
+            'max': float(durations.max())}
+
+
+def snapshot():
+    """Metrics of this run so far as JSON ready dict, spans reduced to their statistics in seconds."""
+    with _lock:
+        spans = {name: list(durations) for name, durations in _spans.items() if durations}
+        counters = dict(_counters)
+    return {'time': datetime.datetime.now().isoformat(), 'pid': os.getpid(), 'argv': sys.argv,
+            'wall': time.time() - _started,
+            'spans': {name: span_statistics(durations) for name, durations in sorted(spans.items())},
+            'counters': counters}
+
+
+def dump(filename):
+    """Append the metrics of this run to filename as one JSON line."""
+    with open(filename, 'a') as f:
+        f.write(json.dumps(snapshot()) + '\n')
+
+
+def summary(run=None):
+    """Text table of a snapshot, by default of the current run."""
+    run = run or snapshot()
+    lines = ['{:<24} {:>7} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'span', 'count', 'total [s]', 'mean [ms]', 'p50 [ms]', 'p90 [ms]', 'max [ms]')]
+    for name, stats in run['spans'].items():
+        lines.append('{:<24} {:>7d} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+            name, stats['count'], stats['total'], 1e3 * stats['mean'], 1e3 * stats['p50'], 1e3 * stats['p90'],
+            1e3 * stats['max']))
+    if run['counters']:
+        lines.append('{:<24} {:>18} {:>14}'.format('counter', 'value', 'per second'))
+        for name, value in sorted(run['counters'].items()):
+            lines.append('{:<24} {:>18} {:>14.4g}'.format(name, value, value / run['wall'] if run['wall'] else 0))
+    return '\n'.join(lines)
+
+
+def read_runs(filename):
+    with open(filename) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+if os.environ.get(ENV_VARIABLE):
+    enable()
+    atexit.register(dump, os.environ[ENV_VARIABLE])
+
+# ------------------------
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print(__doc__)
+        sys.exit(1)
+    for run in read_runs(sys.argv[1]):
+        print('{} pid {}: {}'.format(run['time'], run['pid'], ' '.join(run['argv'])))
+        print(summary(run))
+        print()
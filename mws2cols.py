@@ -1,13 +1,21 @@
 #!/usr/bin/env python
 """Convert MWS multi parameteric plots to columns
 
+usage:
+mws2cols <filename>                   print the columns
+mws2cols <filename> <filename> ...    write <filename>.csv for each, in parallel
+
 by github.com/jepio 2014"""
 
 from __future__ import print_function, division
-import sys, re
+import sys, re, os
 from itertools import islice
+from multiprocessing import Pool
+import numpy as np
 
-number_pattern = re.compile("(\d+\.?\d*([eE][+-]\d+)?)")
+number_pattern = re.compile(r"(\d+\.?\d*([eE][+-]\d+)?)")
+separator = "Mode Number"
+CHUNK_SIZE = 1 << 20  # characters read at once
 
 def parse(run_data):
     data = re.finditer(number_pattern, run_data)
@@ -18,10 +26,61 @@ def parse(run_data):
     r_over_q = islice(numbers, 1, None, 2)
     return (run_number, " ".join(r_over_q,))
 
-file_ = open(sys.argv[1])
-data = file_.read()
-runs = data.split("Mode Number")
+def iter_run_texts(file_, chunk_size=CHUNK_SIZE):
+    """Yield the text of every run of an open export, reading it in chunks
+    so that only one run is held in memory."""
+    buffer = ""
+    started = False
+    for chunk in iter(lambda: file_.read(chunk_size), ""):
+        buffer += chunk
+        parts = buffer.split(separator)
+        # the last part may still grow, or end in a cut separator
+        buffer = parts.pop()
+        for part in parts:
+            if started:
+                yield part
+            started = True
+    if started:
+        yield buffer
+
+def iter_runs(file_, chunk_size=CHUNK_SIZE):
+    """Yield (run_number, r_over_q array) for every run of an open export."""
+    for run in iter_run_texts(file_, chunk_size):
+        run_number, r_over_q = parse(run)
+        yield run_number, np.array(r_over_q.split(), dtype=float)
+
+def to_array(filename):
+    """Runs of an export as array, one row per run: run number, R/Q values."""
+    with open(filename) as file_:
+        rows = [np.concatenate(([float(run_number)], r_over_q)) for run_number, r_over_q in iter_runs(file_)]
+    return np.array(rows)
+
+def to_csv(filename, output=None):
+    """Write the runs of an export as CSV, returns the output filename."""
+    output = output or os.path.splitext(filename)[0] + ".csv"
+    with open(filename) as file_, open(output, "w") as out:
+        for run in iter_run_texts(file_):
+            run_number, r_over_q = parse(run)
+            out.write(",".join([run_number] + r_over_q.split()) + "\n")
+    return output
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    if len(sys.argv) == 2:
+        with open(sys.argv[1]) as file_:
+            for run in iter_run_texts(file_):
+                run_number, r_over_q = parse(run)
+                print(run_number, r_over_q)
+        return
+    pool = Pool()
+    try:
+        for output in pool.imap(to_csv, sys.argv[1:]):
+            print(output)
+    finally:
+        pool.close()
+        pool.join()
 
-for run in runs[1:]:
-    run_number, r_over_q = parse(run)
-    print(run_number, r_over_q)
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,15 @@ Code for calculation of R/Q from simulation data in Microwave Studio (R)
 
 December 2014 - Xaratustrah
 
+Batch mode, R/Q of many modes or geometry variants in parallel:
+
+mwstools.py <manifest> <output>
+
+The manifest has one line per mode: field export filename and f0 in Hz,
+lines starting with # are ignored. Results go to <output>.csv (file, f0,
+R/Q on axis) and <output>.npz with all maps. Maps on the same mesh are
+stacked and share one set of axes.
+
 """
 
 import numpy as np
@@ -11,35 +20,182 @@ from matplotlib import rcParams
 from mpl_toolkits.mplot3d import Axes3D
 from matplotlib import cm
 import os
-from sympy.mpmath.libmp.libelefun import e_fixed
+import sys
+import json
+import subprocess
+from multiprocessing import Pool
+import metrics
+from traceloader import CHUNK_SIZE, iter_blocks, count_lines
+
+# np.trapz is called np.trapezoid since NumPy 2.0
+trapezoid = getattr(np, 'trapezoid', None) or np.trapz
+
+FIELD_COLUMN = 5  # column of the export that is integrated
+
+
+def read_columns(filename, columns, skip_header=2, chunk_size=CHUNK_SIZE):
+    """Read only the given columns of a large white space separated export.
+
+    Rows are counted first and the output array is allocated once, then the
+    text is parsed block by block and only the wanted columns are kept.
+    """
+    with open(filename, 'rb') as f:
+        for _ in range(skip_header):
+            f.readline()
+        data_start = f.tell()
+        first = f.readline().split()
+        if not first:
+            return np.zeros((0, len(columns)))
+        n_columns = len(first)
+        f.seek(data_start)
+        out = np.empty((count_lines(f, chunk_size), len(columns)))
+        row = 0
+        for block in iter_blocks(f, chunk_size):
+            values = np.fromstring(block.decode('ascii'), sep=' ').reshape(-1, n_columns)
+            out[row:row + len(values)] = values[:, columns]
+            row += len(values)
+    return out[:row]
+
+
+def infer_grid(x, y, z):
+    """Axes of a grid given as flat columns with x changing fastest, then y, then z."""
+    xnum = int(np.argmax(y != y[0])) or int(np.argmax(z != z[0])) or len(x)
+    plane = int(np.argmax(z != z[0])) or len(x)
+    if plane % xnum or len(x) % plane:
+        raise ValueError('Coordinates do not form a regular x, y, z grid.')
+    return x[:xnum].copy(), y[:plane:xnum].copy(), z[::plane].copy()
+
+
+def load_field(filename, column=FIELD_COLUMN, cache=True):
+    """Grid axes and |E| as (znum, ynum, xnum) array from an MWS field export.
+
+    With cache the parsed grid is stored as filename.field.npy next to the
+    export, with axes and the size and mtime of the export in
+    filename.field.json. As long as the export is unchanged later calls
+    memory map the .npy file instead of parsing the text.
+    """
+    npy, meta = filename + '.field.npy', filename + '.field.json'
+    stat = os.stat(filename)
+    key = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'column': column}
+    if cache and os.path.exists(npy):
+        try:
+            with open(meta) as f:
+                stored = json.load(f)
+            if stored['key'] == key:
+                return (np.array(stored['xs']), np.array(stored['ys']), np.array(stored['zs']),
+                        np.load(npy, mmap_mode='r'))
+        except (OSError, ValueError, KeyError):
+            pass
+    data = read_columns(filename, [0, 1, 2, column])
+    xs, ys, zs = infer_grid(data[:, 0], data[:, 1], data[:, 2])
+    e_field = np.abs(data[:, 3]).reshape(len(zs), len(ys), len(xs))
+    if cache:
+        try:
+            np.save(npy, e_field)
+            with open(meta, 'w') as f:
+                json.dump({'key': key, 'xs': xs.tolist(), 'ys': ys.tolist(), 'zs': zs.tolist()}, f)
+        except OSError:
+            pass  # e.g. read-only directory, work without the cache
+    return xs, ys, zs, e_field
+
+
+class FieldInterpolator:
+    """Trilinear interpolation of a (znum, ynum, xnum) field on its grid axes.
+
+    Cell lookup is vectorized over any number of points, points outside
+    the grid get fill_value.
+    """
+
+    def __init__(self, xs, ys, zs, e_field, fill_value=np.nan):
+        self.axes = [np.asarray(zs, dtype=float), np.asarray(ys, dtype=float), np.asarray(xs, dtype=float)]
+        self.e_field = np.asarray(e_field)  # kept in its dtype, float32 values are upcast per chunk by the weights
+        self.fill_value = fill_value
+
+    def __call__(self, points):
+        """Field at points given as (..., 3) array of x, y, z."""
+        points = np.asarray(points, dtype=float)
+        shape = points.shape[:-1]
+        points = points.reshape(-1, 3)
+        index = []
+        weight = []
+        outside = np.zeros(len(points), dtype=bool)
+        for axis, p in zip(self.axes, [points[:, 2], points[:, 1], points[:, 0]]):
+            if len(axis) == 1:
+                index.append(np.zeros(len(p), dtype=int))
+                weight.append(np.zeros(len(p)))
+                outside |= p != axis[0]
+                continue
+            i = np.clip(np.searchsorted(axis, p, side='right') - 1, 0, len(axis) - 2)
+            index.append(i)
+            weight.append((p - axis[i]) / (axis[i + 1] - axis[i]))
+            outside |= (p < axis[0]) | (p > axis[-1])
+        (iz, iy, ix), (wz, wy, wx) = index, weight
+        dz, dy, dx = [1 if len(axis) > 1 else 0 for axis in self.axes]
+        f = self.e_field
+        value = ((1 - wz) * ((1 - wy) * ((1 - wx) * f[iz, iy, ix] + wx * f[iz, iy, ix + dx]) +
+                             wy * ((1 - wx) * f[iz, iy + dy, ix] + wx * f[iz, iy + dy, ix + dx])) +
+                 wz * ((1 - wy) * ((1 - wx) * f[iz + dz, iy, ix] + wx * f[iz + dz, iy, ix + dx]) +
+                       wy * ((1 - wx) * f[iz + dz, iy + dy, ix] + wx * f[iz + dz, iy + dy, ix + dx])))
+        value[outside] = self.fill_value
+        return value.reshape(shape)
+
+
+def straight_paths(starts, ends, n_samples=200):
+    """Straight beam paths as (n_paths, n_samples, 3) array from (n_paths, 3) start and end points."""
+    t = np.linspace(0, 1, n_samples)[np.newaxis, :, np.newaxis]
+    starts = np.asarray(starts, dtype=float)[:, np.newaxis, :]
+    ends = np.asarray(ends, dtype=float)[:, np.newaxis, :]
+    return starts + t * (ends - starts)
 
 
 class RoQ:
-    def __init__(self, filename, f0, step):
-        """Initialize"""
+    def __init__(self, filename, f0, step=None, dtype=float, slab_size=None, column=FIELD_COLUMN, cache=True):
+        """Initialize
+
+        The grid shape and step are taken from the coordinates in the
+        file, step is only kept for compatibility. dtype float32 halves
+        the memory of the field, slab_size limits the number of z planes
+        integrated at once (see get_roq). cache keeps the parsed grid
+        next to the export (see load_field).
+        """
 
         self.f0 = f0
         self.roq = 0
         self.filename = filename
         self.step = step
+        self.dtype = dtype
+        self.slab_size = slab_size
+        self.interpolator = None
+        if filename is None:  # grid is given by from_arrays
+            self.filename_woe = 'roq'
+            return
         self.filename_woe = os.path.splitext(self.filename)[0]
-        self.data = np.genfromtxt(self.filename, dtype=float, skip_header=2)
-        self.x, self.y, self.z, self.e_field = self.data[:, 0], self.data[:, 1], self.data[:, 2], abs(self.data[:, 5])
-        self.xmin = self.x[0]
-        self.xmax = self.x[-1]
-        self.xnum = int((self.xmax - self.xmin) / self.step + 1)
-        self.ymin = self.y[0]
-        self.ymax = self.y[-1]
-        self.ynum = int((self.ymax - self.ymin) / self.step + 1)
-        self.zmin = self.z[0]
-        self.zmax = self.z[-1]
-        self.znum = int((self.zmax - self.zmin) / self.step + 1)
-
-        # Now reshape on z, then y, then x, x being the fastest changing in the nested loop xyz format
-        self.x = self.x.reshape(self.znum, self.ynum, self.xnum)
-        self.y = self.y.reshape(self.znum, self.ynum, self.xnum)
-        self.z = self.z.reshape(self.znum, self.ynum, self.xnum)
-        self.e_field = self.e_field.reshape(self.znum, self.ynum, self.xnum)
+        self.setup(*load_field(self.filename, column, cache))
+
+    @classmethod
+    def from_arrays(cls, x, y, z, e_field, f0, step=None, dtype=float, slab_size=None):
+        """RoQ from flat coordinate and field arrays in MWS order, x changing fastest."""
+        roq = cls(None, f0, step, dtype, slab_size)
+        xs, ys, zs = infer_grid(np.asarray(x), np.asarray(y), np.asarray(z))
+        roq.setup(xs, ys, zs, np.abs(e_field).reshape(len(zs), len(ys), len(xs)))
+        return roq
+
+    def setup(self, xs, ys, zs, e_field):
+        """Set the grid from its axes and the (znum, ynum, xnum) field and calculate R/Q."""
+        self.xs, self.ys, self.zs = xs, ys, zs
+        self.xmin, self.xmax, self.xnum = xs[0], xs[-1], len(xs)
+        self.ymin, self.ymax, self.ynum = ys[0], ys[-1], len(ys)
+        self.zmin, self.zmax, self.znum = zs[0], zs[-1], len(zs)
+        if self.step is None and len(xs) > 1:
+            self.step = xs[1] - xs[0]
+
+        # Coordinates as (z, y, x) arrays like the field, these are views and take no memory
+        shape = (self.znum, self.ynum, self.xnum)
+        self.x = np.broadcast_to(xs[np.newaxis, np.newaxis, :], shape)
+        self.y = np.broadcast_to(ys[np.newaxis, :, np.newaxis], shape)
+        self.z = np.broadcast_to(zs[:, np.newaxis, np.newaxis], shape)
+        self.e_field = np.asarray(e_field).astype(self.dtype, copy=False)
+        self.interpolator = None  # built from the new field on first use
 
         self.roq = self.get_roq()
 
@@ -66,17 +222,53 @@ class RoQ:
         plt.savefig(self.filename_woe + "_efield_alongy.pdf")
         plt.savefig(self.filename_woe + "_efieldy_alongy.eps")
 
+    @metrics.timed('roq.get_roq')
     def get_roq(self):
-        """Calculate the R/Q matrix"""
-
-        roq = np.zeros((self.xnum, self.ynum))
-        for i in range(self.xnum):
-            for j in range(self.ynum):
-                roq[i, j] = np.trapz(self.e_field[:, j, i], self.z[:, j, i])
-        roq = roq ** 2 / self.f0 / 2 / np.pi / 1e4  # factor because of cm t meter conversion
-        roq = roq.T
+        """Calculate the R/Q matrix
+
+        The field is integrated along z for all (y, x) at once. With
+        slab_size set, only that many z planes are processed at a time,
+        neighbouring slabs share one plane, so the temporaries stay small.
+        """
+
+        slab_size = max(self.slab_size or self.znum, 1)
+        integral = np.zeros((self.ynum, self.xnum), dtype=self.dtype)
+        for start in range(0, max(self.znum - 1, 1), slab_size):
+            stop = min(start + slab_size, self.znum - 1) + 1
+            integral += trapezoid(self.e_field[start:stop], self.zs[start:stop].astype(self.dtype), axis=0)
+        roq = integral ** 2 / self.f0 / 2 / np.pi / 1e4  # factor because of cm t meter conversion
+        metrics.count('roq.points', self.e_field.size)
         return roq
 
+    def get_interpolator(self):
+        """Interpolator of the field, built on first use and kept for later queries."""
+
+        if self.interpolator is None:
+            self.interpolator = FieldInterpolator(self.xs, self.ys, self.zs, self.e_field)
+        return self.interpolator
+
+    def get_path_roq(self, paths, chunk_size=1 << 20):
+        """R/Q along arbitrary beam paths
+
+        paths is an (n_paths, n_samples, 3) array of x, y, z points in cm,
+        for example from straight_paths. The field is interpolated at all
+        points and integrated over the path length, up to chunk_size points
+        at a time. Paths leaving the grid give nan.
+        """
+
+        paths = np.asarray(paths, dtype=float)
+        if paths.ndim == 2:
+            paths = paths[np.newaxis]
+        interpolator = self.get_interpolator()
+        per_chunk = max(chunk_size // paths.shape[1], 1)
+        integral = np.empty(len(paths))
+        for start in range(0, len(paths), per_chunk):
+            chunk = paths[start:start + per_chunk]
+            field = interpolator(chunk)
+            ds = np.linalg.norm(np.diff(chunk, axis=1), axis=2)
+            integral[start:start + per_chunk] = np.sum((field[:, 1:] + field[:, :-1]) / 2 * ds, axis=1)
+        return integral ** 2 / self.f0 / 2 / np.pi / 1e4  # factor because of cm t meter conversion
+
     def plot_color_map(self, xlo, xhi, ylo, yhi, for_publication=False):
         """Plot the color map for the R/Q"""
 
@@ -111,7 +303,7 @@ class RoQ:
         """Plot a 3D view. """
 
         fig = plt.figure()
-        ax = fig.gca(projection='3d')
+        ax = fig.add_subplot(projection='3d')
         ax.plot_wireframe(self.x[0, ylo:yhi, xlo:xhi],
                           self.y[0, ylo:yhi, xlo:xhi],
                           self.roq[ylo:yhi, xlo:xhi])  # , cmap = cm.gist_heat)
@@ -122,17 +314,135 @@ class RoQ:
         plt.savefig(self.filename_woe + "_surf.eps")
         plt.savefig(self.filename_woe + "_surf.pdf")
 
-    def plot_3d_movie(self, xlo, xhi, ylo, yhi):
-        """Plot a movie"""
+    def plot_3d_movie(self, xlo, xhi, ylo, yhi, output=None, azimuths=range(100, 460), processes=None, fps=30):
+        """Plot a movie
 
-        fig = plt.figure()
-        ax = fig.gca(projection='3d')
-        ax.plot_wireframe(self.x[0, ylo:yhi, xlo:xhi],
-                          self.y[0, ylo:yhi, xlo:xhi],
-                          self.roq[ylo:yhi, xlo:xhi])  # , cmap = cm.gist_heat)
-        plt.title('R/Q surface')
-        plt.xlabel('x offset [cm]')
-        plt.ylabel('y offset [cm]')
-        for ii in range(100, 460, 1):
-            ax.view_init(elev=10., azim=ii)
-            plt.savefig(self.filename_woe + "movie{}".format(ii) + '.png')
+        The azimuth range is split over a process pool, every worker draws
+        the wireframe once and then only changes the view. Without output
+        the frames are saved as PNG files like before. An output ending in
+        .gif is written as animated GIF, any other name is encoded by
+        ffmpeg, which gets the raw frames through a pipe.
+        """
+
+        surface = (np.array(self.x[0, ylo:yhi, xlo:xhi]), np.array(self.y[0, ylo:yhi, xlo:xhi]),
+                   np.array(self.roq[ylo:yhi, xlo:xhi]))
+        azimuths = list(azimuths)
+        prefix = self.filename_woe + "movie" if output is None else None
+        chunk = max(len(azimuths) // (4 * (processes or os.cpu_count() or 1)), 1)
+        tasks = [azimuths[i:i + chunk] for i in range(0, len(azimuths), chunk)]
+        with Pool(processes, initializer=movie_worker_init, initargs=surface + (prefix,)) as pool:
+            frames = (frame for frames in pool.imap(movie_frames, tasks) for frame in frames)
+            if output is None:
+                for _ in frames:
+                    pass
+            elif output.lower().endswith('.gif'):
+                from PIL import Image
+                images = [Image.frombuffer('RGBA', size, data, 'raw', 'RGBA', 0, 1).convert('P') for size, data in frames]
+                images[0].save(output, save_all=True, append_images=images[1:], duration=int(1000 / fps), loop=0)
+            else:
+                encoder = None
+                try:
+                    for (width, height), data in frames:
+                        if encoder is None:
+                            encoder = subprocess.Popen(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'rawvideo',
+                                                        '-pix_fmt', 'rgba', '-s', '{}x{}'.format(width, height),
+                                                        '-r', str(fps), '-i', '-', '-pix_fmt', 'yuv420p', output],
+                                                       stdin=subprocess.PIPE)
+                        encoder.stdin.write(data)
+                finally:
+                    if encoder is not None:
+                        encoder.stdin.close()
+                        encoder.wait()
+        return output
+
+
+# Figure of a plot_3d_movie worker process, drawn once and reused for all its frames
+movie = {}
+
+
+def movie_worker_init(x, y, roq, prefix):
+    plt.switch_backend('Agg')
+    fig = plt.figure()
+    ax = fig.add_subplot(projection='3d')
+    ax.plot_wireframe(x, y, roq)  # , cmap = cm.gist_heat)
+    plt.title('R/Q surface')
+    plt.xlabel('x offset [cm]')
+    plt.ylabel('y offset [cm]')
+    movie.update(fig=fig, ax=ax, prefix=prefix)
+
+
+def movie_frames(azimuths):
+    """Render frames for the azimuths, as PNG files or as ((width, height), RGBA bytes)."""
+    frames = []
+    for ii in azimuths:
+        movie['ax'].view_init(elev=10., azim=ii)
+        if movie['prefix'] is not None:
+            movie['fig'].savefig(movie['prefix'] + "{}".format(ii) + '.png')
+            continue
+        movie['fig'].canvas.draw()
+        frames.append((movie['fig'].canvas.get_width_height(), bytes(movie['fig'].canvas.buffer_rgba())))
+    return frames
+
+
+def read_manifest(filename):
+    """List of (field filename, f0) from a manifest, relative names are taken from its directory."""
+    base = os.path.dirname(os.path.abspath(filename))
+    jobs = []
+    with open(filename) as f:
+        for line in f:
+            fields = line.split('#', 1)[0].replace(',', ' ').split()
+            if fields:
+                jobs.append((os.path.join(base, fields[0]), float(fields[1])))
+    return jobs
+
+
+def roq_job(job):
+    """Worker of run_batch: R/Q map of one mode."""
+    filename, f0 = job
+    roq = RoQ(filename, f0)
+    return roq.xs, roq.ys, roq.roq, roq()
+
+
+def run_batch(jobs, output, processes=None):
+    """Calculate R/Q for (filename, f0) jobs in a process pool and write one table and one map file.
+
+    <output>.npz holds for every distinct mesh k the axes x_k, y_k and the
+    maps roq_k as (n_modes, ynum, xnum); the table <output>.csv names the
+    mesh and the index of each mode in it.
+    """
+    with Pool(processes) as pool:
+        results = pool.map(roq_job, jobs)
+
+    meshes = []  # (xs, ys, list of maps)
+    rows = []
+    for (filename, f0), (xs, ys, roq, on_axis) in zip(jobs, results):
+        for mesh, (mesh_xs, mesh_ys, maps) in enumerate(meshes):
+            if np.array_equal(mesh_xs, xs) and np.array_equal(mesh_ys, ys):
+                break
+        else:
+            meshes.append((xs, ys, []))
+            mesh = len(meshes) - 1
+        rows.append((filename, f0, on_axis, mesh, len(meshes[mesh][2])))
+        meshes[mesh][2].append(roq)
+
+    arrays = {}
+    for mesh, (xs, ys, maps) in enumerate(meshes):
+        arrays['x_{}'.format(mesh)] = xs
+        arrays['y_{}'.format(mesh)] = ys
+        arrays['roq_{}'.format(mesh)] = np.stack(maps)
+    np.savez(output + '.npz', **arrays)
+    with open(output + '.csv', 'w') as f:
+        f.write('# filename, f0 [Hz], R/Q on axis [ohm], mesh, index\n')
+        for row in rows:
+            f.write('{}, {:.9e}, {:.9e}, {}, {}\n'.format(*row))
+    return rows
+
+
+# ------------------------
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3:
+        for row in run_batch(read_manifest(sys.argv[1]), sys.argv[2]):
+            print('{}\t{:.6e}\t{:.4f}'.format(*row[:3]))
+    else:
+        print(__doc__)
@@ -10,14 +10,30 @@ import sys
 import os
 import numpy as np
 import datetime
+import collections
+import asyncio
+import threading
+import metrics
+
+def join_commands(commands):#one SCPI line, ";:" starts again from the root, common commands (*OPC? ...) take a plain ";"
+    line = ""
+    for command in commands:
+        if line:
+            line += ";" if command.startswith("*") else ";:"
+        line += command
+    return line
+
 
 class NetworkAnalyser:
 
-    def __init__(self, cal_filename, host, port=5025, BUFF_SIZE=1, center=407, span=2000, n_points=4001, bandwidth=1.0, power=0.0, average=10, measurement="S11" ):#Initialize object. Socket, adress, everything for start work
+    def __init__(self, cal_filename, host, port=5025, BUFF_SIZE=65536, center=407, span=2000, n_points=4001, bandwidth=1.0, power=0.0, average=10, measurement="S11", data_format="ASCII", timeout=60.0 ):#Initialize object. Socket, adress, everything for start work
         self.sock=socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.timeout=timeout#seconds without an answer before socket.timeout is raised, must be longer than a whole averaged sweep
+        self.sock.settimeout(timeout)
         self.address=host# VNA adress
         self.portnumber=port
-        self.BUFF_SIZE=BUFF_SIZE#I want take one symbol per time. TCP destroy every formatting and send bytes
+        self.BUFF_SIZE=BUFF_SIZE#bytes per recv call, TCP gives us whatever is there so we buffer it ourselves
+        self.rx_buffer=bytearray()#bytes received but not yet consumed
         self.cal_filename=cal_filename
         self.center = center # MHz
         self.span = span  # kHz
@@ -26,47 +42,223 @@ class NetworkAnalyser:
         self.power = power #  dBm
         self.average = average #samples for averaging
         self.measurement = measurement #S-parameter we measure
+        self.data_format = data_format.upper() #ASCII, REAL,32 or REAL,64
+        self.queue = [] #commands waiting to be sent in one go
+        self.state = {} #settings the instrument has confirmed with *OPC?
+        self.pending = {} #settings queued or sent but not yet confirmed
+        self.identity = None #*IDN? answer of the configured instrument
 
-    def connect(self): #connect to NA and tell it about settings and procedures
+    @metrics.timed('vna.connect')
+    def connect(self, reset=True): #connect to NA and tell it about settings and procedures. reset=False keeps the settings the instrument already has, see reconnect
         self.sock.connect((self.address, self.portnumber)) #connect to VNA
-        self.sock.send("@REM".encode('ascii')) # invoke remote mode
-        self.sock.send("*RST;*WAI;*CLS".encode('ascii')) # reset everything
-        self.sock.send(("CALC:PAR:MEAS 'TRC1','"+self.measurement+"'").encode('ascii'))
-        self.sock.send("INIT:CONT OFF".encode('ascii')) # single sweep
-        self.sock.send(("SWE:COUN " + str(self.average)).encode('ascii'))
-        self.sock.send(("SWE:POIN " + str(self.n_points)).encode('ascii'))
-        self.sock.send(("AVER:COUN " + str(self.average)).encode('ascii'))
-        self.sock.send("AVER ON".encode('ascii'))
-        self.sock.send(("BAND " + str(self.bandwidth) + "KHZ").encode('ascii'))
-        self.sock.send(("FREQ:CENT " + str(self.center) + "MHZ").encode('ascii'))
-        self.sock.send(("FREQ:SPAN " + str(self.span) + "KHZ").encode('ascii'))
-        self.sock.send(("SOUR:POW " + str(self.power)).encode('ascii'))
-        self.sock.send(("MMEM:LOAD:CORR 1,"+str(self.cal_filename)).encode('ascii')) # calibration file, to be replaced in every test
-
-    def get_data(self):#get string from TCP, char array to string, split string and convert to floats. Returns float array of data with frequencies
-        data = [] #empty array to put symbols in it
-
-        self.sock.send("*WAI;SYST:ERR:ALL?".encode('ascii'))
-        self.sock.send("AVER:CLE\n".encode('ascii')) #clean previous frames
-        self.sock.send("INIT\n".encode('ascii')) #initiate new cycle
-        self.sock.send("*WAI;CALC:DATA? SDAT\n".encode('ascii')) #send data
-
-        tmp = self.sock.recv(self.BUFF_SIZE).decode('ascii')#first symbol in TCP port in non-byte format. Normal number
-        data.append(tmp)#add first symbol
-
-        while tmp != '\n':#until the end of the data in TCP
-            tmp = self.sock.recv(self.BUFF_SIZE).decode('ascii')
-            
-            data.append(tmp) #add symbol to array
-
-        data = (''.join(map(str, data))) #create string from char array
-        data_array = np.fromstring(data, sep=',')
-        data_array = np.reshape(data_array, (int(len(data_array)/2),2))
-        freqs= np.linspace(start = self.center - self.span / 2000, stop = self.center + self.span / 2000, num = self.n_points)
-        freqs = np.reshape(freqs, (self.n_points, 1))
-        data_array = np.append(freqs, data_array, axis=1)
-        return data_array
+        self.sock.sendall("@REM\n".encode('ascii')) # invoke remote mode
+        if not reset and self.state and self.kept_state():
+            self.configure() # only settings changed while the connection was down
+            return
+        self.write("*RST") # reset everything
+        self.write("*CLS")
+        self.write("INIT:CONT OFF") # single sweep
+        self.write("AVER ON")
+        self.state = {} # instrument is in reset state now, nothing is known
+        self.pending = {}
+        self.configure()
+        self.identity = self.query("*IDN?")
+
+    def reconnect(self):#new connection after an error, without *RST and calibration reload if the instrument kept its settings
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.rx_buffer = bytearray()
+        self.queue = []
+        self.pending = {} # never confirmed, may not have arrived
+        self.connect(reset=False)
+
+    def query(self, command):#send one query at once and return its answer line
+        self.sock.sendall((command + "\n").encode('ascii'))
+        return self.recv_until(b'\n').decode('ascii').strip()
+
+    def kept_state(self):#True if it is the instrument we configured and it was not switched off since (power on bit 7 of *ESR? is clear)
+        return self.query("*IDN?") == self.identity and not int(self.query("*ESR?")) & 128
+
+    def settings(self):#instrument settings as SCPI header -> value, in the order they have to be sent
+        settings = [
+            ("CALC:PAR:MEAS 'TRC1',", "'" + self.measurement + "'"),
+            ("SWE:COUN", str(self.average)),
+            ("SWE:POIN", str(self.n_points)),
+            ("AVER:COUN", str(self.average)),
+            ("BAND", str(self.bandwidth) + "KHZ"),
+            ("FREQ:CENT", str(self.center) + "MHZ"),
+            ("FREQ:SPAN", str(self.span) + "KHZ"),
+            ("SOUR:POW", str(self.power)),
+            ("MMEM:LOAD:CORR 1,", str(self.cal_filename)), # calibration file, to be replaced in every test
+            ("FORM", self.data_format), # trace transfer format
+        ]
+        if self.data_format != "ASCII":
+            settings.append(("FORM:BORD", "SWAP")) # little endian, least significant byte first
+        return settings
+
+    def configure(self, **kwargs):#change settings, e.g. configure(center=410, span=500). Only what differs from the instrument state is sent
+        for key, value in kwargs.items():
+            if not hasattr(self, key):
+                raise AttributeError("Unknown setting " + key)
+            setattr(self, key, value)
+        self.queue_changes()
+        self.flush()
+
+    def queue_changes(self):#queue the settings that differ from the last known instrument state
+        self.data_format = self.data_format.upper()
+        for header, value in self.settings():
+            if self.pending.get(header, self.state.get(header)) != value:
+                self.write(header + ("" if header.endswith(",") else " ") + value)
+                self.pending[header] = value
+
+    def write(self, command):#queue a command, it will be sent with the next flush
+        self.queue.append(command)
+
+    def flush(self):#send all queued commands in one line and wait until the instrument has processed them
+        if not self.queue:
+            return
+        self.queue.append("*OPC?")
+        self.sock.sendall((join_commands(self.queue) + "\n").encode('ascii'))
+        self.queue = []
+        self.recv_until(b'\n') # answer to *OPC?
+        self.state.update(self.pending)
+        self.pending = {}
+
+    def recv_until(self, terminator=b'\n'):#read from TCP in big chunks until terminator, keep the rest for the next call
+        while True:
+            idx = self.rx_buffer.find(terminator)
+            if idx >= 0:
+                break
+            self.recv_more()
+        line = bytes(self.rx_buffer[:idx])
+        del self.rx_buffer[:idx + len(terminator)]
+        return line
+
+    def recv_exactly(self, n_bytes):#read exactly n_bytes from TCP
+        while len(self.rx_buffer) < n_bytes:
+            self.recv_more()
+        chunk = bytes(self.rx_buffer[:n_bytes])
+        del self.rx_buffer[:n_bytes]
+        return chunk
+
+    def recv_more(self):
+        chunk = self.sock.recv(self.BUFF_SIZE)
+        if not chunk:
+            raise ConnectionError("Connection to VNA closed while reading data.")
+        self.rx_buffer += chunk
+        metrics.count('vna.bytes_received', len(chunk))
+
+    def recv_block(self):#read IEEE 488.2 definite length block #<n><length><data>
+        if self.recv_exactly(1) != b'#':
+            raise ValueError("VNA response is not a binary block.")
+        n_digits = int(self.recv_exactly(1))
+        if n_digits == 0:
+            raise ValueError("Indefinite length blocks are not supported.")
+        length = int(self.recv_exactly(n_digits))
+        payload = self.recv_exactly(length)
+        self.recv_until(b'\n') # block is followed by a terminator
+        return payload
+
+    def read_trace(self):#get trace as flat float array, either from ASCII or binary transfer
+        with metrics.span('vna.sweep_wait'): # the first bytes arrive when the sweep is done
+            if not self.rx_buffer:
+                self.recv_more()
+        with metrics.span('vna.transfer'):
+            if self.data_format == "ASCII":
+                return self.decode_trace(self.recv_until(b'\n'))
+            return self.decode_trace(self.recv_block())
 
+    def decode_trace(self, payload):#ASCII line or binary block payload to flat float array
+        if self.data_format == "ASCII":
+            return np.array(payload.split(b','), dtype=float)
+        dtype = '<f8' if self.data_format.endswith("64") else '<f4'
+        return np.frombuffer(payload, dtype=dtype).astype(float)
+
+    def trigger_command(self):#start a new averaged sweep and request its data
+        self.write("AVER:CLE") #clean previous frames
+        self.write("INIT") #initiate new cycle
+        self.write("*WAI")
+        command = (join_commands(self.queue + ["CALC:DATA? SDAT"]) + "\n").encode('ascii') #send data
+        self.queue = []
+        return command
+
+    def trigger(self):#send the sweep request, the answer is read by fetch
+        self.sock.sendall(self.trigger_command())
+
+    def get_frequencies(self):#frequency axis in MHz
+        return np.linspace(start = self.center - self.span / 2000, stop = self.center + self.span / 2000, num = self.n_points)
+
+    def fetch(self, out=None):#read the data requested by trigger into out, or a new array. Columns are freq, Re, Im
+        return self.to_columns(self.read_trace(), out)
+
+    def to_columns(self, trace, out=None):#flat Re, Im trace to columns freq, Re, Im
+        if out is None:
+            out = np.empty((self.n_points, 3))
+        out[:, 0] = self.get_frequencies()
+        out[:, 1:] = np.reshape(trace, (int(len(trace)/2),2))
+        metrics.count('vna.sweeps')
+        metrics.count('vna.points', self.n_points)
+        return out
+
+    def get_data(self):#get trace from TCP, parse it and add frequencies. Returns float array of data with frequencies
+        self.trigger()
+        return self.fetch()
+
+    def stream(self, n_sweeps=None, capacity=8, drop=False):#generator of (timestamp, data) for continuous acquisition
+        """Sweep continuously and yield (timestamp, data) tuples.
+
+        A background thread keeps the instrument busy: the next sweep is
+        triggered before the current one is read and parsed. Sweeps go into
+        a preallocated SweepRingBuffer of the given capacity. If the consumer
+        falls behind the thread waits, or with drop=True overwrites the
+        oldest unread sweep. The yielded array is a view into the buffer and
+        stays valid until the next sweep is requested, copy it to keep it.
+        """
+        ring = SweepRingBuffer(capacity, self.n_points, drop=drop)
+        worker = threading.Thread(target=self.acquire, args=(ring, n_sweeps), daemon=True)
+        worker.start()
+        try:
+            while True:
+                item = ring.get()
+                if item is None:
+                    break
+                yield item
+        finally:
+            ring.close()
+            worker.join()
+            if ring.error is not None:
+                raise ring.error
+
+    def acquire(self, ring, n_sweeps=None):#producer for stream, pipelines trigger and fetch
+        try:
+            count = 0
+            self.trigger()
+            while not ring.closed and (n_sweeps is None or count < n_sweeps):
+                count += 1
+                pending = n_sweeps is None or count < n_sweeps
+                slot = ring.reserve()
+                if slot is None: # consumer is gone
+                    self.fetch()
+                    break
+                timestamp = datetime.datetime.now()
+                if pending:
+                    self.trigger() # instrument starts the next sweep while we read this one
+                self.fetch(out=slot)
+                ring.commit(timestamp)
+                if not pending:
+                    break
+            else:
+                self.fetch() # drain the sweep that was already requested
+        except Exception as error:
+            ring.error = error
+        finally:
+            ring.finish()
+
+    @metrics.timed('vna.save')
     def save_to_file(self, filename, data_array, touchstone=False):
        
        
@@ -80,9 +272,255 @@ class NetworkAnalyser:
 
         return filename
     
+    def save_to_archive(self, archive, data_array, timestamp=None):#append to a sweeparchive.SweepArchive instead of one file per sweep
+        archive.append(data_array, timestamp=timestamp, vna=self)
+        archive.flush() # a crash must not lose sweeps that are still pending
+        return archive.filename
+
     def get_nice_filename(self):#delete datafiles directory
         return  str(datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S"))
         
+class SweepRingBuffer:
+    """Fixed number of preallocated sweeps shared by a producer and a consumer thread."""
+
+    def __init__(self, capacity, n_points, drop=False):
+        self.data = np.zeros((capacity + 1, n_points, 3)) # one extra slot is held by the consumer
+        self.free = collections.deque(range(capacity + 1)) #slots that can be written
+        self.ready = collections.deque() #(slot, timestamp) of unread sweeps, oldest first
+        self.drop = drop
+        self.dropped = 0 #number of sweeps overwritten before they were read
+        self.held = None #slot the consumer is looking at
+        self.writing = None #slot the producer is filling
+        self.done = False
+        self.closed = False
+        self.error = None
+        self.cond = threading.Condition()
+
+    def reserve(self):#producer side, returns the array to write the next sweep into
+        with self.cond:
+            while not self.free and not self.drop and not self.closed:
+                self.cond.wait()
+            if self.closed:
+                return None
+            if not self.free: # consumer is too slow, forget the oldest sweep
+                self.free.append(self.ready.popleft()[0])
+                self.dropped += 1
+            self.writing = self.free.popleft()
+            return self.data[self.writing]
+
+    def commit(self, timestamp):
+        with self.cond:
+            self.ready.append((self.writing, timestamp))
+            self.writing = None
+            self.cond.notify_all()
+
+    def get(self):#consumer side, returns (timestamp, data) or None when the producer has finished
+        with self.cond:
+            if self.held is not None:
+                self.free.append(self.held)
+                self.held = None
+                self.cond.notify_all()
+            while not self.ready and not self.done:
+                self.cond.wait()
+            if not self.ready:
+                return None
+            self.held, timestamp = self.ready.popleft()
+            return timestamp, self.data[self.held]
+
+    def finish(self):
+        with self.cond:
+            self.done = True
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+class AsyncNetworkAnalyser(NetworkAnalyser):
+    """NetworkAnalyser on asyncio streams, so several instruments can be driven from one event loop.
+
+    Every network operation is guarded by timeout (seconds). sweep() retries
+    a failed sweep up to retries times and reconnects in between. If the
+    instrument still has the confirmed settings (same *IDN?, no power on
+    event in *ESR?), it is not reset, only unconfirmed settings are sent
+    again.
+    """
+
+    def __init__(self, cal_filename, host, timeout=30.0, retries=3, **kwargs):
+        NetworkAnalyser.__init__(self, cal_filename, host, timeout=timeout, **kwargs)
+        self.sock.close() # asyncio opens its own connection
+        self.sock = None
+        self.reader = None
+        self.writer = None
+        self.retries = retries
+
+    async def connect(self, reset=True):
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.address, self.portnumber), self.timeout)
+        self.writer.write("@REM\n".encode('ascii')) # invoke remote mode
+        if not reset and self.state and await self.kept_state():
+            await self.configure()
+            return
+        self.write("*RST") # reset everything
+        self.write("*CLS")
+        self.write("INIT:CONT OFF") # single sweep
+        self.write("AVER ON")
+        self.state = {}
+        self.pending = {}
+        await self.configure()
+        self.identity = await self.query("*IDN?")
+
+    async def query(self, command):
+        self.writer.write((command + "\n").encode('ascii'))
+        line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+        if not line:
+            raise EOFError("Connection to VNA closed while waiting for an answer.")
+        return line.decode('ascii').strip()
+
+    async def kept_state(self):
+        return await self.query("*IDN?") == self.identity and not int(await self.query("*ESR?")) & 128
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+        self.reader = self.writer = None
+
+    async def configure(self, **kwargs):
+        for key, value in kwargs.items():
+            if not hasattr(self, key):
+                raise AttributeError("Unknown setting " + key)
+            setattr(self, key, value)
+        self.queue_changes()
+        await self.flush()
+
+    async def flush(self):
+        if not self.queue:
+            return
+        self.queue.append("*OPC?")
+        self.writer.write((join_commands(self.queue) + "\n").encode('ascii'))
+        self.queue = []
+        if not await asyncio.wait_for(self.reader.readline(), self.timeout): # answer to *OPC?
+            raise EOFError("Connection to VNA closed before settings were confirmed.")
+        self.state.update(self.pending)
+        self.pending = {}
+
+    async def read_trace(self):
+        if self.data_format == "ASCII":
+            line = await self.reader.readline()
+            if not line:
+                raise EOFError("Connection to VNA closed while reading data.")
+            return self.decode_trace(line)
+        header = await self.reader.readexactly(2)
+        if header[:1] != b'#' or header[1:] == b'0':
+            raise ValueError("VNA response is not a definite length binary block.")
+        length = int(await self.reader.readexactly(int(header[1:])))
+        payload = await self.reader.readexactly(length)
+        await self.reader.readline() # block is followed by a terminator
+        return self.decode_trace(payload)
+
+    async def get_data(self):
+        self.writer.write(self.trigger_command())
+        trace = await asyncio.wait_for(self.read_trace(), self.timeout)
+        return self.to_columns(trace)
+
+    async def sweep(self):#get_data with reconnect on timeout or lost connection
+        for attempt in range(self.retries + 1):
+            try:
+                if self.writer is None:
+                    await self.connect(reset=False) # full reset only on the first connect or after a power cycle
+                return await self.get_data()
+            except (OSError, EOFError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                await self.close()
+                self.queue = []
+                self.pending = {}
+                if attempt == self.retries:
+                    raise
+
+
+class AnalyserPool:
+    """Several AsyncNetworkAnalyser instruments that are configured and swept concurrently.
+
+        pool = AnalyserPool([AsyncNetworkAnalyser('a.cal', '192.168.254.2'),
+                             AsyncNetworkAnalyser('b.cal', '192.168.254.3')])
+        async def main():
+            await pool.connect()
+            async for timestamp, index, data in pool.stream(100):
+                ...
+            await pool.close()
+
+        asyncio.run(main())
+
+    Instruments that keep failing after their retries are recorded in
+    errors (index -> exception) and left out, the others go on.
+    """
+
+    def __init__(self, analysers):
+        self.analysers = list(analysers)
+        self.errors = {}
+
+    async def connect(self):
+        results = await asyncio.gather(*[vna.connect() for vna in self.analysers], return_exceptions=True)
+        self.errors = {}
+        for index, result in enumerate(results):
+            if isinstance(result, Exception):
+                self.errors[index] = result
+
+    async def configure(self, **kwargs):#same settings on every instrument
+        indices = [i for i in range(len(self.analysers)) if i not in self.errors]
+        results = await asyncio.gather(*[self.analysers[i].configure(**kwargs) for i in indices], return_exceptions=True)
+        for index, result in zip(indices, results):
+            if isinstance(result, Exception):
+                self.errors[index] = result
+
+    async def close(self):
+        await asyncio.gather(*[vna.close() for vna in self.analysers])
+
+    async def sweep(self):#one sweep of all working instruments, returns list of (timestamp, index, data)
+        indices = [i for i in range(len(self.analysers)) if i not in self.errors]
+        results = await asyncio.gather(*[self.analysers[i].sweep() for i in indices], return_exceptions=True)
+        sweeps = []
+        for index, result in zip(indices, results):
+            if isinstance(result, Exception):
+                self.errors[index] = result
+            else:
+                sweeps.append((datetime.datetime.now(), index, result))
+        return sweeps
+
+    async def stream(self, n_sweeps=None):#async generator of (timestamp, index, data), merged in order of arrival
+        queue = asyncio.Queue()
+        finished = object()
+
+        async def run(index, vna):
+            count = 0
+            try:
+                while n_sweeps is None or count < n_sweeps:
+                    data = await vna.sweep()
+                    count += 1
+                    await queue.put((datetime.datetime.now(), index, data))
+            except Exception as error:
+                self.errors[index] = error
+            finally:
+                await queue.put(finished)
+
+        tasks = [asyncio.ensure_future(run(i, vna)) for i, vna in enumerate(self.analysers) if i not in self.errors]
+        running = len(tasks)
+        try:
+            while running:
+                item = await queue.get()
+                if item is finished:
+                    running -= 1
+                else:
+                    yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
 #--------------
 
 if __name__ == "__main__":
@@ -4,33 +4,80 @@
 read specan files and convert them to ROOT
 using PyROOT
 
+A series of traces can also be packed into one ROOT file with
+--pack <output.root>, see specanbatch.py.
+
 2020 Xaratustrah
 
 """
 
-import sys
 import os
 from iqtools import tools
-from ROOT import TH1F, TFile
-from ROOT import gROOT
+import specanbatch
+import numpy as np
+from ROOT import TH1F, TH2F, TFile, TTree
+
+
+def fill(hist, values):
+    """Set all bin contents at once, values without under- and overflow bins."""
+    content = np.zeros(hist.GetNcells())
+    if hist.GetDimension() == 1:
+        content[1:-1] = values
+    else:  # ROOT stores x fastest, with under- and overflow on both axes
+        grid = content.reshape(hist.GetNbinsY() + 2, hist.GetNbinsX() + 2)
+        grid[1:-1, 1:-1] = np.asarray(values).T
+    hist.SetContent(content)
 
 
-def process(filename):
-    gROOT.Reset()
+def process(filename, output=None):
     filename_base = os.path.basename(filename)
     filename_wo_ext = os.path.splitext(filename)[0]
     ff, pp, units = tools.read_trace_xml(filename)
-    h1f = TH1F('h1f', filename_base, len(ff), ff[0], ff[-1])
-    for i in range(len(pp)):
-        h1f.SetBinContent(i, pp[i])
-    myfile = TFile(filename_wo_ext + '.root', 'RECREATE')
+    edges = specanbatch.bin_edges(ff)
+    h1f = TH1F('h1f', filename_base, len(ff), edges[0], edges[-1])
+    fill(h1f, pp)
+    myfile = TFile(output or filename_wo_ext + '.root', 'RECREATE')
     h1f.Write()
     myfile.Close()
 
 
+def pack(filenames, output):
+    """Write a series of traces into one ROOT file.
+
+    The tree 'spectra' has one entry per trace with its timestamp (file
+    modification time) and power array. The frequency axis is stored once
+    as histogram 'frequency', the whole series as TH2F 'waterfall' with
+    the trace index on x and frequency on y.
+    """
+    ff, power, times, units = specanbatch.collect(filenames, tools.read_trace_xml)
+    n_traces, n_points = power.shape
+    edges = specanbatch.bin_edges(ff)
+    myfile = TFile(output, 'RECREATE')
+
+    frequency = TH1F('frequency', 'frequency [{}]'.format(units[0]), n_points, edges[0], edges[-1])
+    fill(frequency, ff)
+    frequency.Write()
+
+    waterfall = TH2F('waterfall', 'power [{}]'.format(units[1]), n_traces, -0.5, n_traces - 0.5,
+                     n_points, edges[0], edges[-1])
+    fill(waterfall, power)
+    waterfall.Write()
+
+    tree = TTree('spectra', 'spectrum analyzer traces')
+    timestamp = np.zeros(1)
+    spectrum = np.zeros(n_points, dtype=np.float32)
+    tree.Branch('timestamp', timestamp, 'timestamp/D')
+    tree.Branch('power', spectrum, 'power[{}]/F'.format(n_points))
+    for k in range(n_traces):
+        timestamp[0] = times[k]
+        spectrum[:] = power[k]
+        tree.Fill()
+    tree.Write()
+    myfile.Close()
+
+
 def main():
-    for file in sys.argv[1:]:
-        process(file)
+    specanbatch.main(backend='root')
 
 
 # ------------------------
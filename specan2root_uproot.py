@@ -3,44 +3,88 @@
 """
 read specan files and convert them to ROOT
 using uproot
+
+Histograms are written from NumPy arrays in one go with uproot 4 and
+later. With uproot 3 the MyTH1 helper of uproot_methods is used.
+A series of traces can also be packed into one ROOT file with
+--pack <output.root>, see specanbatch.py.
+
 2020 Xaratustrah
 
 """
 
-import sys
 import os
 from iqtools import tools
+import specanbatch
+import numpy as np
 
 import types
 import uproot
-import uproot_methods.classes.TH1
+
+UPROOT3 = int(uproot.__version__.split('.')[0]) < 4
+if UPROOT3:
+    import uproot_methods.classes.TH1
+
+    class MyTH1(uproot_methods.classes.TH1.Methods, list):
+        def __init__(self, low, high, values, title=""):
+            self._fXaxis = types.SimpleNamespace()
+            self._fXaxis._fNbins = len(values)
+            self._fXaxis._fXmin = low
+            self._fXaxis._fXmax = high
+            # contents include the under- and overflow bins
+            self.extend(np.concatenate(([0.], np.asarray(values, dtype=float), [0.])).tolist())
+            self._fTitle = title
+            self._classname = "TH1F"
 
 
-class MyTH1(uproot_methods.classes.TH1.Methods, list):
-    def __init__(self, low, high, values, title=""):
-        self._fXaxis = types.SimpleNamespace()
-        self._fXaxis._fNbins = len(values)
-        self._fXaxis._fXmin = low
-        self._fXaxis._fXmax = high
-        for x in values:
-            self.append(float(x))
-        self._fTitle = title
-        self._classname = "TH1F"
+def histogram(values, edges, title=""):
+    """Object that uproot writes as TH1F with the given title."""
+    if UPROOT3:
+        return MyTH1(edges[0], edges[-1], values, title=title)
+    values = np.asarray(values, dtype=np.float32)
+    edges = np.asarray(edges, dtype=float)
+    centres = (edges[:-1] + edges[1:]) / 2
+    sumw = float(values.sum(dtype=float))
+    # contents include the under- and overflow bins
+    data = np.concatenate(([0], values, [0])).astype(np.float32)
+    return uproot.writing.identify.to_TH1x(
+        fName=None, fTitle=title, data=data, fEntries=len(values), fTsumw=sumw, fTsumw2=sumw,
+        fTsumwx=float((values * centres).sum()), fTsumwx2=float((values * centres ** 2).sum()),
+        fSumw2=np.zeros(0), fXaxis=uproot.writing.identify.to_TAxis(
+            fName='xaxis', fTitle='', fNbins=len(values), fXmin=edges[0], fXmax=edges[-1]))
 
 
-def process(filename):
+def process(filename, output=None):
     filename_base = os.path.basename(filename)
     filename_wo_ext = os.path.splitext(filename)[0]
     ff, pp, units = tools.read_specan_xml(filename)
-    h1f = MyTH1(ff[0], ff[-1], pp, title=filename_base)
-    file = uproot.recreate(filename_wo_ext + '.root',
+    h1f = histogram(pp, specanbatch.bin_edges(ff), title=filename_base)
+    file = uproot.recreate(output or filename_wo_ext + '.root',
                            compression=uproot.ZLIB(4))
     file["h1f"] = h1f
 
 
+def pack(filenames, output):
+    """Write a series of traces into one ROOT file.
+
+    The tree 'spectra' has one entry per trace with its timestamp (file
+    modification time) and power array, the frequency axis is stored once
+    as histogram 'frequency' and the whole series as 2D histogram
+    'waterfall', trace index x frequency. Needs uproot 4 or later.
+    """
+    if UPROOT3:
+        raise RuntimeError('Packing a series needs uproot 4 or later, use the root backend.')
+    ff, power, times, units = specanbatch.collect(filenames, tools.read_specan_xml)
+    n_traces, n_points = power.shape
+    edges = specanbatch.bin_edges(ff)
+    file = uproot.recreate(output, compression=uproot.ZLIB(4))
+    file["frequency"] = histogram(ff, edges, title='frequency [{}]'.format(units[0]))
+    file["spectra"] = {"timestamp": times, "power": power.astype(np.float32)}
+    file["waterfall"] = (power.astype(np.float32), np.arange(n_traces + 1) - 0.5, edges)
+
+
 def main():
-    for file in sys.argv[1:]:
-        process(file)
+    specanbatch.main(backend='uproot')
 
 
 # ------------------------
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Batch conversion of spectrum analyzer traces, shared by specan2csv.py,
+specan2root_pyroot.py and specan2root_uproot.py
+
+Files are converted in a process pool. A file is skipped if its output is
+up to date: newer than the input (check 'mtime'), or converted from the
+same content before (check 'hash', using a manifest file
+.specanbatch.json in the directory of each input). Directories are
+searched for trace files.
+
+Output back-ends are the process(filename, output) functions of the
+converter scripts, registered in BACKENDS with the extension they write.
+They are only imported when used, so missing ROOT libraries do not matter
+for CSV conversion.
+
+usage:
+specanbatch [--backend csv|root|uproot] [--check mtime|hash] [--force] <file or directory> ...
+specanbatch --backend root|uproot --pack <output.root> <file or directory> ...
+
+--pack writes the whole series into one ROOT file, as a tree of spectra
+and a time x frequency histogram, instead of one file per trace.
+
+2026 Xaratustrah
+
+"""
+
+import sys
+import os
+import json
+import hashlib
+import importlib
+from multiprocessing import Pool
+import numpy as np
+
+# name: (module with process(filename, output), output extension)
+BACKENDS = {
+    'csv': ('specan2csv', '.csv'),
+    'root': ('specan2root_pyroot', '.root'),
+    'uproot': ('specan2root_uproot', '.root'),
+}
+TRACE_EXTENSIONS = ('.xml', '.specan')
+MANIFEST = '.specanbatch.json'
+
+
+def register_backend(name, module, extension):
+    BACKENDS[name] = (module, extension)
+
+
+def expand(paths):
+    """Trace files in paths, directories are searched for TRACE_EXTENSIONS."""
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames += sorted(os.path.join(path, name) for name in os.listdir(path)
+                                if os.path.splitext(name)[1].lower() in TRACE_EXTENSIONS)
+        else:
+            filenames.append(path)
+    return filenames
+
+
+def output_name(filename, backend):
+    return os.path.splitext(filename)[0] + BACKENDS[backend][1]
+
+
+def file_hash(filename):
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(directory, manifest):
+    filename = os.path.join(directory, MANIFEST)
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=0, sort_keys=True)
+    os.replace(filename + '.tmp', filename)
+
+
+def up_to_date(filename, backend, check, manifests):
+    output = output_name(filename, backend)
+    if not os.path.exists(output):
+        return False
+    if check == 'mtime':
+        return os.path.getmtime(output) >= os.path.getmtime(filename)
+    entry = manifests[os.path.dirname(os.path.abspath(filename))].get(os.path.basename(filename), {})
+    return entry.get(backend) == file_hash(filename)
+
+
+def convert(job):
+    """Worker: convert one file, returns (filename, hash or None, error message or None)."""
+    filename, backend, check = job
+    try:
+        module = importlib.import_module(BACKENDS[backend][0])
+        module.process(filename, output_name(filename, backend))
+    except Exception as error:
+        return filename, None, '{}: {}'.format(type(error).__name__, error)
+    return filename, file_hash(filename) if check == 'hash' else None, None
+
+
+def load_backend(backend):
+    """Module of a backend, raises ImportError with the backend name if its libraries are missing."""
+    if backend not in BACKENDS:
+        raise ValueError('Unknown backend {}, choose from {}.'.format(backend, ', '.join(sorted(BACKENDS))))
+    try:
+        return importlib.import_module(BACKENDS[backend][0])
+    except ImportError as error:
+        raise ImportError('Backend {} is not available: {}'.format(backend, error))
+
+
+def run(paths, backend='csv', check='mtime', force=False, processes=None):
+    """Convert all traces in paths that are not up to date. Returns (converted, skipped, failed) lists."""
+    load_backend(backend)  # fail before the pool starts, not in every worker
+    if check not in ('mtime', 'hash'):
+        raise ValueError('check must be mtime or hash.')
+    filenames = expand(paths)
+    manifests = {}
+    if check == 'hash':
+        for filename in filenames:
+            directory = os.path.dirname(os.path.abspath(filename))
+            if directory not in manifests:
+                manifests[directory] = read_manifest(directory)
+    todo = [f for f in filenames if force or not up_to_date(f, backend, check, manifests)]
+    todo_set = set(todo)
+    skipped = [f for f in filenames if f not in todo_set]
+    converted, failed = [], []
+    if todo:
+        with Pool(processes) as pool:
+            for filename, digest, error in pool.imap_unordered(convert, [(f, backend, check) for f in todo]):
+                if error is not None:
+                    failed.append((filename, error))
+                    continue
+                converted.append(filename)
+                if digest is not None:
+                    directory = os.path.dirname(os.path.abspath(filename))
+                    manifests[directory].setdefault(os.path.basename(filename), {})[backend] = digest
+    for directory, manifest in manifests.items():
+        write_manifest(directory, manifest)
+    return converted, skipped, failed
+
+
+def read_trace(job):
+    reader, filename = job
+    ff, pp, units = reader(filename)
+    return ff, pp, units, os.path.getmtime(filename)
+
+
+def collect(filenames, reader, processes=None):
+    """Read a series of traces in parallel with reader(filename) -> (ff, pp, units).
+
+    Returns the frequency axis, a (n_traces, n_points) power array in the
+    order of filenames, the file modification times as timestamps and the
+    units. All traces must share the frequency axis.
+    """
+    with Pool(processes) as pool:
+        traces = pool.map(read_trace, [(reader, filename) for filename in filenames])
+    ff, _, units, _ = traces[0]
+    power = np.empty((len(traces), len(ff)))
+    times = np.empty(len(traces))
+    for k, (f, pp, _, mtime) in enumerate(traces):
+        if len(f) != len(ff) or not np.allclose(f, ff):
+            raise ValueError('{} has a different frequency axis than {}.'.format(filenames[k], filenames[0]))
+        power[k] = pp
+        times[k] = mtime
+    return np.asarray(ff), power, times, units
+
+
+def bin_edges(ff):
+    """Histogram bin edges that put the bin centres on the sample frequencies."""
+    ff = np.asarray(ff, dtype=float)
+    half = (ff[-1] - ff[0]) / (len(ff) - 1) / 2 if len(ff) > 1 else 0.5
+    return np.linspace(ff[0] - half, ff[-1] + half, len(ff) + 1)
+
+
+def main(argv=None, backend='csv'):
+    """Command line of the converter scripts, backend is their default."""
+    args = list(sys.argv[1:] if argv is None else argv)
+    check, force, pack = 'mtime', False, None
+    paths = []
+    while args:
+        arg = args.pop(0)
+        if arg == '--backend':
+            backend = args.pop(0)
+        elif arg == '--check':
+            check = args.pop(0)
+        elif arg == '--force':
+            force = True
+        elif arg == '--pack':
+            pack = args.pop(0)
+        else:
+            paths.append(arg)
+    if not paths:
+        print(__doc__)
+        sys.exit(1)
+    try:
+        module = load_backend(backend)
+    except (ImportError, ValueError) as error:
+        print(error)
+        sys.exit(1)
+    if pack is not None:
+        if not hasattr(module, 'pack'):
+            print('Backend {} cannot pack a series.'.format(backend))
+            sys.exit(1)
+        filenames = expand(paths)
+        module.pack(filenames, pack)
+        print('{} traces packed into {}.'.format(len(filenames), pack))
+        return
+    converted, skipped, failed = run(paths, backend, check, force)
+    for filename, error in failed:
+        print('{}: {}'.format(filename, error))
+    print('{} converted, {} up to date, {} failed.'.format(len(converted), len(skipped), len(failed)))
+    if failed:
+        sys.exit(1)
+
+
+# ------------------------
+
+if __name__ == '__main__':
+    main()
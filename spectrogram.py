@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Time x frequency store for long series of spectrum analyzer traces
+
+A store is a directory with the shared frequency axis (frequency.npy),
+the power of all traces as one append-only float32 matrix (power.f32,
+one row per trace), their timestamps (times.f64) and the names of the
+ingested files (sources.txt). The power matrix is memory mapped, so a
+frequency band or a time window of a whole shift is read without loading
+or parsing the rest:
+
+    store = SpectrogramStore('shift42')
+    ingest(['traces/'], store)
+    times, freqs, power = store.window(t_start, t_stop)
+    times, freqs, power = store.band(244.5e6, 245.5e6)
+
+Traces must be appended in time order, select() relies on it and
+append() rejects older traces. The timestamp of a trace is the
+modification time of its file.
+
+usage:
+spectrogram <store> <file or directory> ...    ingest new traces into the store
+
+2026 Xaratustrah
+
+"""
+
+import sys
+import os
+import json
+import numpy as np
+import specanbatch
+
+INGEST_CHUNK = 256  # traces read in parallel at once
+
+
+class SpectrogramStore:
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.freqs = None
+        self.units = None
+        self.mmap = None
+        meta = self.path('meta.json')
+        if os.path.exists(meta):
+            with open(meta) as f:
+                self.units = json.load(f)['units']
+            self.freqs = np.load(self.path('frequency.npy'))
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def __len__(self):
+        if self.freqs is None:
+            return 0
+        n_power = os.path.getsize(self.path('power.f32')) // (4 * len(self.freqs))
+        n_times = os.path.getsize(self.path('times.f64')) // 8
+        return min(n_power, n_times)  # an interrupted append is not counted
+
+    def sources(self):
+        try:
+            with open(self.path('sources.txt')) as f:
+                return [line.rstrip('\n') for line in f][:len(self)]
+        except OSError:
+            return []
+
+    def append(self, freqs, power, times, units=('', ''), sources=None):
+        """Append traces, power as (n_traces, n_points) on the frequency axis of the store."""
+        power = np.atleast_2d(np.asarray(power, dtype='<f4'))
+        times = np.atleast_1d(np.asarray(times, dtype='<f8'))
+        if self.freqs is None:
+            self.freqs = np.asarray(freqs, dtype=float)
+            self.units = list(units)
+            np.save(self.path('frequency.npy'), self.freqs)
+            for name in ('power.f32', 'times.f64', 'sources.txt'):
+                open(self.path(name), 'wb').close()
+            with open(self.path('meta.json'), 'w') as f:
+                json.dump({'units': self.units, 'n_points': len(self.freqs)}, f)
+        elif len(freqs) != len(self.freqs) or not np.allclose(freqs, self.freqs):
+            raise ValueError('Traces do not match the frequency axis of the store.')
+        if power.shape[1] != len(self.freqs) or len(times) != len(power):
+            raise ValueError('Power must be (n_traces, {}) with one timestamp per trace.'.format(len(self.freqs)))
+        count = len(self)
+        last = self.times()[-1:]
+        if np.any(np.diff(np.concatenate((last, times))) < 0):
+            raise ValueError('Traces must be appended in time order, the store ends at {}.'.format(
+                last[0] if len(last) else None))
+        # sources first, a row only counts once power and time are written as well
+        sources = [''] * len(times) if sources is None else list(sources)
+        self.trim_sources(count)
+        with open(self.path('sources.txt'), 'a') as f:
+            f.writelines(name + '\n' for name in sources)
+        with open(self.path('power.f32'), 'ab') as f:
+            f.truncate(count * 4 * len(self.freqs))
+            f.write(power.tobytes())
+        with open(self.path('times.f64'), 'ab') as f:
+            f.truncate(count * 8)
+            f.write(times.tobytes())
+        self.mmap = None
+
+    def trim_sources(self, count):
+        """Cut sources.txt to count lines, the names of an interrupted append are dropped."""
+        with open(self.path('sources.txt'), 'rb+') as f:
+            text = f.read()
+            if text.count(b'\n') <= count:
+                return
+            cut = 0
+            for _ in range(count):
+                cut = text.index(b'\n', cut) + 1
+            f.truncate(cut)
+
+    def power(self):
+        """Memory map of the (n_traces, n_points) power matrix."""
+        count = len(self)
+        if self.mmap is None or len(self.mmap) != count:
+            if count == 0:
+                return np.zeros((0, 0 if self.freqs is None else len(self.freqs)), dtype='<f4')
+            self.mmap = np.memmap(self.path('power.f32'), dtype='<f4', mode='r', shape=(count, len(self.freqs)))
+        return self.mmap
+
+    def times(self):
+        return np.fromfile(self.path('times.f64'), dtype='<f8', count=len(self)) if len(self) else np.zeros(0)
+
+    def select(self, t_start=None, t_stop=None, f_lo=None, f_hi=None):
+        """Times, frequencies and power for t_start <= t < t_stop and f_lo <= f <= f_hi, None is open."""
+        times = self.times()
+        first = 0 if t_start is None else np.searchsorted(times, t_start, side='left')
+        last = len(times) if t_stop is None else np.searchsorted(times, t_stop, side='left')
+        if self.freqs is None:
+            return times[first:last], np.zeros(0), np.zeros((0, 0), dtype='<f4')
+        lo = 0 if f_lo is None else np.searchsorted(self.freqs, f_lo, side='left')
+        hi = len(self.freqs) if f_hi is None else np.searchsorted(self.freqs, f_hi, side='right')
+        return times[first:last], self.freqs[lo:hi], np.array(self.power()[first:last, lo:hi])
+
+    def window(self, t_start, t_stop):
+        return self.select(t_start=t_start, t_stop=t_stop)
+
+    def band(self, f_lo, f_hi):
+        return self.select(f_lo=f_lo, f_hi=f_hi)
+
+
+def ingest(paths, store, reader=None, processes=None):
+    """Add traces from files and directories that are not yet in the store, in time order.
+
+    reader(filename) -> (ff, pp, units), default iqtools read_trace_xml.
+    Raises ValueError if a new trace is older than the last one in the
+    store. Returns the number of traces added.
+    """
+    if reader is None:
+        from iqtools import tools
+        reader = tools.read_trace_xml
+    known = set(store.sources())
+    filenames = [os.path.abspath(f) for f in specanbatch.expand(paths)]
+    filenames = sorted((f for f in filenames if f not in known), key=os.path.getmtime)
+    last = store.times()[-1:]
+    older = [f for f in filenames if len(last) and os.path.getmtime(f) < last[0]]
+    if older:
+        raise ValueError('{} traces are older than the end of the store, e.g. {}.'.format(len(older), older[0]))
+    for start in range(0, len(filenames), INGEST_CHUNK):
+        chunk = filenames[start:start + INGEST_CHUNK]
+        ff, power, times, units = specanbatch.collect(chunk, reader, processes)
+        store.append(ff, power, times, units, sources=chunk)
+    return len(filenames)
+
+
+# ------------------------
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+    store = SpectrogramStore(sys.argv[1])
+    try:
+        added = ingest(sys.argv[2:], store)
+    except ValueError as error:
+        print(error)
+        sys.exit(1)
+    print('{} traces added, {} in store.'.format(added, len(store)))
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Append-only binary archive for VNA sweeps from networkanalyzer.py
+
+One file per session instead of one text file per sweep. The file is a
+JSON header padded to HEADER_SIZE bytes followed by fixed size records,
+so sweep k is at a known offset and the whole data block can be memory
+mapped. Every record holds the timestamp and the settings of the sweep
+next to the (n_points, 3) data array (freq, Re, Im):
+
+    archive = SweepArchive('session.swa', n_points=4001)
+    archive.append(myvna.get_data(), vna=myvna)
+    archive[10]                     # record of sweep 10
+    archive.between(t_start, t_end) # records in a time range
+    archive.export_touchstone(10, 'sweep10')
+
+usage:
+sweeparchive <archive>                           print summary
+sweeparchive <archive> <index> <out_filename>    export one sweep as .s1p
+
+2026 Xaratustrah
+
+"""
+
+import sys
+import os
+import json
+import datetime
+import numpy as np
+
+MAGIC = 'SWEEPARCHIVE'
+VERSION = 1
+HEADER_SIZE = 4096
+SETTINGS = ['center', 'span', 'bandwidth', 'power', 'average']
+
+
+def record_dtype(n_points):
+    fields = [('timestamp', '<f8')] + [(name, '<f8') for name in SETTINGS]
+    return np.dtype(fields + [('data', '<f8', (n_points, 3))])
+
+
+def to_seconds(timestamp):
+    if isinstance(timestamp, datetime.datetime):
+        return timestamp.timestamp()
+    return float(timestamp)
+
+
+class SweepArchive:
+    def __init__(self, filename, n_points=None, metadata=None, chunk_size=1):
+        """Open an archive, or create it if n_points is given and the file does not exist.
+
+        Appended sweeps are written in chunks of chunk_size records, by
+        default every sweep goes to disk at once. With a larger chunk_size
+        call flush() or close() to write a partial chunk.
+        """
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.pending = []
+        self.mmap = None
+        if os.path.exists(filename):
+            with open(filename, 'rb') as f:
+                header = json.loads(f.read(HEADER_SIZE).rstrip(b'\0').decode('utf-8'))
+            if header.get('magic') != MAGIC:
+                raise ValueError('{} is not a sweep archive.'.format(filename))
+            self.n_points = header['n_points']
+            self.metadata = header['metadata']
+        else:
+            if n_points is None:
+                raise ValueError('n_points is needed to create a new archive.')
+            self.n_points = n_points
+            self.metadata = metadata or {}
+            header = json.dumps({'magic': MAGIC, 'version': VERSION, 'n_points': n_points,
+                                 'settings': SETTINGS, 'metadata': self.metadata}).encode('utf-8')
+            if len(header) > HEADER_SIZE:
+                raise ValueError('Archive metadata is too large.')
+            with open(filename, 'wb') as f:
+                f.write(header.ljust(HEADER_SIZE, b'\0'))
+        self.dtype = record_dtype(self.n_points)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.stored() + len(self.pending)
+
+    def stored(self):#complete records on disk, a partly written last record is ignored
+        return (os.path.getsize(self.filename) - HEADER_SIZE) // self.dtype.itemsize
+
+    def append(self, data, timestamp=None, vna=None, **settings):
+        """Add one sweep. Settings are taken from vna (a NetworkAnalyser) and/or keywords."""
+        if data.shape != (self.n_points, 3):
+            raise ValueError('Sweep has shape {}, archive expects {}.'.format(data.shape, (self.n_points, 3)))
+        record = np.zeros((), dtype=self.dtype)
+        record['timestamp'] = to_seconds(timestamp if timestamp is not None else datetime.datetime.now())
+        for name in SETTINGS:
+            value = settings.get(name, getattr(vna, name, np.nan))
+            record[name] = value
+        record['data'] = data
+        self.pending.append(record)
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        count = self.stored()
+        with open(self.filename, 'ab') as f:
+            f.truncate(HEADER_SIZE + count * self.dtype.itemsize)  # drop a partly written record
+            f.write(np.array(self.pending, dtype=self.dtype).tobytes())
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        self.mmap = None
+
+    def records(self):#memory map over all stored records
+        self.flush()
+        count = self.stored()
+        if self.mmap is None or len(self.mmap) != count:
+            if count == 0:
+                return np.zeros(0, dtype=self.dtype)
+            self.mmap = np.memmap(self.filename, dtype=self.dtype, mode='r', offset=HEADER_SIZE, shape=(count,))
+        return self.mmap
+
+    def __getitem__(self, k):
+        return self.records()[k]
+
+    def timestamps(self):
+        return np.asarray(self.records()['timestamp'])
+
+    def between(self, start, stop):
+        """Records with start <= timestamp < stop. Sweeps are appended in time order, so this is a binary search."""
+        times = self.timestamps()
+        lo, hi = np.searchsorted(times, [to_seconds(start), to_seconds(stop)])
+        return self.records()[lo:hi]
+
+    def export_touchstone(self, k, filename):
+        """Write sweep k as Touchstone .s1p with frequencies in Hz."""
+        record = self[k]
+        data = np.array(record['data'])
+        data[:, 0] *= 1e6  # MHz in the archive
+        filename = filename + '.s1p'
+        stamp = datetime.datetime.fromtimestamp(float(record['timestamp'])).isoformat()
+        np.savetxt(filename, data, header="""# HZ   S   RI   R     50.0\n! Rohde & Schwarz ZVL\n! {}\n!\n! """.format(stamp), comments='')
+        return filename
+
+
+# ------------------------
+
+if __name__ == '__main__':
+    if len(sys.argv) == 2:
+        archive = SweepArchive(sys.argv[1])
+        times = archive.timestamps()
+        print('{} sweeps of {} points'.format(len(archive), archive.n_points))
+        if len(times):
+            print('from {} to {}'.format(datetime.datetime.fromtimestamp(times[0]),
+                                         datetime.datetime.fromtimestamp(times[-1])))
+    elif len(sys.argv) == 4:
+        archive = SweepArchive(sys.argv[1])
+        print('Filename ' + archive.export_touchstone(int(sys.argv[2]), sys.argv[3]) + ' was created')
+    else:
+        print(__doc__)
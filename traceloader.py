@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Fast loader for VNA trace files: ZVL ASCII exports, the .csv and .s1p
+files of networkanalyzer.py, and Touchstone files in general.
+
+The header is detected instead of skipped by a fixed number of lines:
+everything up to the first line that consists of numbers only is header,
+whatever the line endings are. The numbers are parsed in large chunks
+with NumPy instead of line by line.
+
+Parsed arrays can be cached as .npy files. Later loads memory map the
+cache instead of parsing the text again:
+
+    cache = TraceCache()                      # sidecar next to each file
+    cache = TraceCache('/tmp/vnacache', max_entries=10000, max_bytes=2e9)
+    data = load_trace('trace.csv', cache=cache)
+
+A cache entry is valid as long as size and modification time of the text
+file are unchanged, or with validate='hash' as long as its SHA1 is.
+
+usage:
+traceloader <filename> [<filename> ...]
+
+2026 Xaratustrah
+
+"""
+
+import sys
+import os
+import re
+import json
+import hashlib
+import numpy as np
+
+CHUNK_SIZE = 1 << 24  # bytes of text parsed at once
+delimiter_pattern = re.compile(rb'[,;\t\r]')
+delimiter_table = bytes.maketrans(b',;\t\r', b'    ')
+
+
+def parse_numbers(line):
+    """Floats of one text line, or None if it is not purely numeric. A Touchstone ! comment is ignored."""
+    fields = delimiter_pattern.sub(b' ', line.split(b'!', 1)[0]).split()
+    if not fields:
+        return None
+    try:
+        return [float(field) for field in fields]
+    except ValueError:
+        return None
+
+
+def read_header(f):
+    """Read header lines from binary file f. Returns header lines and the first data line."""
+    header = []
+    for line in f:
+        if not line.lstrip().startswith((b'!', b'#')) and parse_numbers(line) is not None:
+            return header, line
+        header.append(line.rstrip(b'\r\n').decode('latin-1'))
+    return header, None
+
+
+def parse_text(filename, chunk_size=CHUNK_SIZE):
+    """Parse a trace text file into a 2D float array, one row per data line."""
+    with open(filename, 'rb') as f:
+        header, first = read_header(f)
+        if first is None:
+            return np.zeros((0, 0))
+        n_columns = len(parse_numbers(first))
+        chunks = [np.array(parse_numbers(first))]
+        chunks += [parse_block(block) for block in iter_blocks(f, chunk_size)]
+    values = np.concatenate(chunks)
+    if len(values) % n_columns:
+        raise ValueError('{}: number of values is not a multiple of {} columns.'.format(filename, n_columns))
+    return values.reshape(-1, n_columns)
+
+
+def iter_blocks(f, chunk_size=CHUNK_SIZE):
+    """Yield the rest of binary file f in blocks of whole lines, the last line may lack its newline."""
+    rest = b''
+    for block in iter(lambda: f.read(chunk_size), b''):
+        block = rest + block
+        cut = block.rfind(b'\n') + 1
+        block, rest = block[:cut], block[cut:]
+        if block:
+            yield block
+    if rest.strip():
+        yield rest
+
+
+def count_lines(f, chunk_size=CHUNK_SIZE):
+    """Number of lines in the rest of binary file f, counting a last line without newline. Rewinds f."""
+    start = f.tell()
+    n_lines = 1 + sum(block.count(b'\n') for block in iter(lambda: f.read(chunk_size), b''))
+    f.seek(start)
+    return n_lines
+
+
+def parse_block(block):
+    # Touchstone allows comments after the data
+    if b'!' in block:
+        block = re.sub(rb'!.*', b'', block)
+    text = block.translate(delimiter_table).decode('ascii')
+    return np.fromstring(text, sep=' ')
+
+
+class TraceCache:
+    def __init__(self, directory=None, validate='stat', max_entries=None, max_bytes=None):
+        """Cache of parsed traces as .npy files.
+
+        directory: None puts the cache as sidecar files next to each trace,
+        otherwise all entries go to this directory.
+        validate: 'stat' compares size and mtime of the source, 'hash' its SHA1.
+        max_entries, max_bytes: limits for a cache directory, least recently
+        used entries are removed when they are exceeded.
+        """
+        if validate not in ('stat', 'hash'):
+            raise ValueError('validate must be stat or hash.')
+        self.directory = directory
+        self.validate = validate
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def paths(self, filename):
+        if self.directory is None:
+            base = filename + '.cache'
+        else:
+            name = hashlib.sha1(os.path.abspath(filename).encode('utf-8')).hexdigest()
+            base = os.path.join(self.directory, name)
+        return base + '.npy', base + '.json'
+
+    def key(self, filename):
+        stat = os.stat(filename)
+        key = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+        if self.validate == 'hash':
+            sha1 = hashlib.sha1()
+            with open(filename, 'rb') as f:
+                for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    sha1.update(block)
+            key = {'size': stat.st_size, 'sha1': sha1.hexdigest()}
+        return key
+
+    def get(self, filename):
+        """Memory mapped cached array, or None if there is no valid entry."""
+        npy, meta = self.paths(filename)
+        try:
+            with open(meta) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if stored != self.key(filename) or not os.path.exists(npy):
+            return None
+        os.utime(meta)  # remember the use for eviction
+        return np.load(npy, mmap_mode='r')
+
+    def put(self, filename, data):
+        """Store data for filename, returns False if the cache cannot be written (e.g. read-only directory)."""
+        npy, meta = self.paths(filename)
+        try:
+            np.save(npy, data)
+            with open(meta, 'w') as f:
+                json.dump(self.key(filename), f)
+        except OSError:
+            return False
+        self.evict()
+        return True
+
+    def evict(self):
+        if self.directory is None or (self.max_entries is None and self.max_bytes is None):
+            return
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                meta = os.path.join(self.directory, name)
+                npy = meta[:-5] + '.npy'
+                size = os.path.getsize(npy) if os.path.exists(npy) else 0
+                entries.append((os.path.getmtime(meta), size, npy, meta))
+        entries.sort()
+        total = sum(entry[1] for entry in entries)
+        while entries and ((self.max_entries is not None and len(entries) > self.max_entries) or
+                           (self.max_bytes is not None and total > self.max_bytes)):
+            _, size, npy, meta = entries.pop(0)
+            for path in (meta, npy):
+                if os.path.exists(path):
+                    os.remove(path)
+            total -= size
+
+
+def load_trace(filename, cache=None):
+    """Load a trace text file as 2D float array, through cache if given."""
+    if cache is not None:
+        data = cache.get(filename)
+        if data is not None:
+            return data
+    data = parse_text(filename)
+    if cache is not None:
+        cache.put(filename, data)
+    return data
+
+
+# ------------------------
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    for filename in sys.argv[1:]:
+        data = load_trace(filename)
+        print('{}: {} rows, {} columns'.format(filename, data.shape[0], data.shape[1]))
@@ -2,17 +2,101 @@
 """
 Calculates cut off frequency of a waveguie
 
+Cutoff handles one dimension and the fundamental mode (TE11 circular,
+TE10 rectangular). For sweeps over many radii or widths, cutoffs()
+returns all modes up to an order at once:
+
+    modes, fc = cutoffs('r', np.linspace(5e-3, 20e-3, 1000), order=5)
+
+fc has one row per dimension and one column per mode, modes lists kind,
+n and m of the columns in ascending cutoff. The zeros of J_n and J_n'
+are computed once into BESSEL_ZEROS, which can be saved to and loaded
+from a .npy file:
+
+    BESSEL_ZEROS.save('bessel_zeros.npy')
+    BESSEL_ZEROS.load('bessel_zeros.npy')
+
+usage:
+waveguide_fc <r|w> <dimension>              fundamental mode
+waveguide_fc <r|w> <dimension> <order>      all modes up to order
+
 Dec 2014 Xaratustrah
 
 """
 
 import sys
 
-import scipy as sp
+import numpy as np
 import scipy.special as sps
 import scipy.constants as spc
 from decimal import *
 
+MODE_DTYPE = np.dtype([('kind', 'U2'), ('n', int), ('m', int)])
+
+
+class BesselZeros:
+    def __init__(self):
+        """Table of the first m zeros of J_n (TM modes) and J_n' (TE modes), grown on demand."""
+        self.jn = np.zeros((0, 0))
+        self.jnp = np.zeros((0, 0))
+
+    def get(self, n_max, m_max):
+        """Zeros of J_n and J_n' for n <= n_max as two (n_max + 1, m_max) arrays."""
+        if self.jn.shape[0] <= n_max or self.jn.shape[1] < m_max:
+            n_max_new = max(n_max + 1, self.jn.shape[0])
+            m_max_new = max(m_max, self.jn.shape[1])
+            self.jn = np.array([sps.jn_zeros(n, m_max_new) for n in range(n_max_new)])
+            self.jnp = np.array([sps.jnp_zeros(n, m_max_new) for n in range(n_max_new)])
+        return self.jn[:n_max + 1, :m_max], self.jnp[:n_max + 1, :m_max]
+
+    def save(self, filename):
+        np.save(filename, np.array([self.jn, self.jnp]))
+
+    def load(self, filename):
+        self.jn, self.jnp = np.load(filename)
+
+
+BESSEL_ZEROS = BesselZeros()
+
+
+def circular_modes(order):
+    """TE and TM modes with n, m <= order and their Bessel zeros, in ascending cutoff."""
+    jn, jnp = BESSEL_ZEROS.get(order, order)
+    n, m = np.indices(jn.shape)
+    modes = np.empty(2 * jn.size, dtype=MODE_DTYPE)
+    modes['kind'] = ['TE'] * jn.size + ['TM'] * jn.size
+    modes['n'] = np.concatenate((n.ravel(), n.ravel()))
+    modes['m'] = np.concatenate((m.ravel(), m.ravel())) + 1
+    zeros = np.concatenate((jnp.ravel(), jn.ravel()))
+    index = np.argsort(zeros, kind='stable')
+    return modes[index], zeros[index]
+
+
+def rectangular_modes(order):
+    """TEn0 modes with n <= order, the only ones set by the width alone, and their factor n * pi."""
+    modes = np.zeros(order, dtype=MODE_DTYPE)
+    modes['kind'] = 'TE'
+    modes['n'] = np.arange(1, order + 1)
+    return modes, modes['n'] * np.pi
+
+
+def cutoffs(type, dimensions, order):
+    """Cutoff frequencies of all modes up to order for an array of radii (r) or widths (w).
+
+    Returns the modes as MODE_DTYPE array and the frequencies in Hz with
+    shape dimensions.shape + (number of modes,).
+    """
+    if order < 1:
+        raise ValueError('Order must be at least 1.')
+    if type.lower() == 'r':
+        modes, zeros = circular_modes(order)
+    elif type.lower() == 'w':
+        modes, zeros = rectangular_modes(order)
+    else:
+        raise ValueError('Type must be r or w.')
+    dimensions = np.asarray(dimensions, dtype=float)
+    return modes, zeros * spc.c / 2 / spc.pi / dimensions[..., np.newaxis]
+
 
 class Cutoff:
     CC = 299792458
@@ -40,7 +124,8 @@ class Cutoff:
         return Cutoff.CC / 2 / self.dimension
 
     def get_frequency_circular(self):
-        return (sps.jnyn_zeros(1, 1)[1] * spc.c / 2 / sp.pi / self.dimension)[0]
+        # first zero of J_1', the TE11 mode
+        return BESSEL_ZEROS.get(1, 1)[1][1, 0] * spc.c / 2 / spc.pi / self.dimension
 
     def get_wavelength(self, freq):
         return Cutoff.CC / freq
@@ -49,5 +134,9 @@ class Cutoff:
 if __name__ == "__main__":
     if (len(sys.argv) == 3):
         print(Cutoff(sys.argv[1], float(sys.argv[2])))
+    elif (len(sys.argv) == 4):
+        modes, fc = cutoffs(sys.argv[1], float(sys.argv[2]), int(sys.argv[3]))
+        for mode, f in zip(modes, fc):
+            print('{}{}{}: {} Hz, {} m'.format(mode['kind'], mode['n'], mode['m'], f, Cutoff.CC / f))
     else:
         print('Please provide radius (r) or width (w) in meters!')
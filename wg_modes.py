@@ -4,6 +4,14 @@
 """
 Calculate waveguide modes
 
+The modes of a rectangular waveguide are computed as one NumPy table,
+text is only formatted for output.
+
+usage:
+wg_modes <a> <b> <nmodes>            cutoffs of all m, n < nmodes
+wg_modes <a> <b> --below <f_max>     TE and TM modes with cutoff up to f_max in Hz
+wg_modes <a> <b> --lowest <k>        the k TE and TM modes with the lowest cutoffs
+
 2017
 Xaratustra
 
@@ -21,39 +29,107 @@ def eng_notation(value, unit=''):
 
 
 class WaveGuide:
-    def __init__(self, a, b):
+    # fields of the mode table, frequencies in Hz, wavelengths in m
+    MODE_DTYPE = np.dtype([('kind', 'U2'), ('m', int), ('n', int), ('fc', float), ('lc', float)])
+
+    def __init__(self, a, b, mu_r=1, epsilon_r=1):
         """
 
         Parameters
         ----------
         a long side x axis corresponding to m
         b short side y axis corresponding to n
+        mu_r, epsilon_r relative permeability and permittivity of the filling
         """
         self.a = a
         self.b = b
-        self.mu_r = 1
-        self.epsilon_r = 1
+        self.mu_r = mu_r
+        self.epsilon_r = epsilon_r
+
+    def get_velocity(self):
+        return 1 / np.sqrt(mu_0 * self.mu_r * epsilon_0 * self.epsilon_r)
+
+    def get_kmn(self, m_max, n_max):
+        """Cutoff wave numbers of all (m, n) with m <= m_max, n <= n_max as (m_max + 1, n_max + 1) array."""
+        m = np.arange(m_max + 1)[:, np.newaxis]
+        n = np.arange(n_max + 1)[np.newaxis, :]
+        return np.sqrt((m * np.pi / self.a) ** 2 + (n * np.pi / self.b) ** 2)
+
+    def get_frequency(self, kmn):
+        return kmn / 2 / np.pi / np.sqrt(mu_0 * self.mu_r * epsilon_0 * self.epsilon_r)
+
+    def get_mode_table(self, m_max, n_max, f_max=None):
+        """TE and TM modes up to m_max, n_max (and f_max if given), sorted by cutoff frequency.
+
+        TE needs m or n above zero, TM needs both. Returns a structured
+        array of MODE_DTYPE, nothing is formatted.
+        """
+        kmn = self.get_kmn(m_max, n_max)
+        fc = self.get_frequency(kmn)
+        m, n = np.indices(fc.shape)
+        te = (m + n) > 0
+        tm = (m > 0) & (n > 0)
+        if f_max is not None:
+            te &= fc <= f_max
+            tm &= fc <= f_max
+        table = np.empty(np.count_nonzero(te) + np.count_nonzero(tm), dtype=WaveGuide.MODE_DTYPE)
+        n_te = np.count_nonzero(te)
+        for kind, mask, part in (('TE', te, table[:n_te]), ('TM', tm, table[n_te:])):
+            part['kind'] = kind
+            part['m'] = m[mask]
+            part['n'] = n[mask]
+            part['fc'] = fc[mask]
+            part['lc'] = 2 * np.pi / kmn[mask]
+        return table[np.argsort(table['fc'], kind='stable')]
+
+    def get_modes_below(self, f_max):
+        """All TE and TM modes with cutoff up to f_max. Only the m, n range that can be below f_max is built."""
+        m_max = int(2 * self.a * f_max / self.get_velocity())
+        n_max = int(2 * self.b * f_max / self.get_velocity())
+        return self.get_mode_table(m_max, n_max, f_max)
+
+    def get_lowest_modes(self, k):
+        """The k TE and TM modes with the lowest cutoff frequencies."""
+        # about pi / 4 * (2 a f / v) * (2 b f / v) (m, n) pairs are below f, TE and TM count twice
+        f_max = self.get_velocity() / 2 * np.sqrt(2 * k / np.pi / self.a / self.b)
+        modes = self.get_modes_below(f_max)
+        while len(modes) < k:
+            f_max *= 1.5
+            modes = self.get_modes_below(f_max)
+        return modes[:k]
 
     def get_fc(self, nmodes):
-        #
-        fc = []
+        """Rows of mode, cutoff and wavelength as text and cutoff in Hz, for m, n below nmodes."""
         np.seterr(all='ignore')
+        kmn = self.get_kmn(nmodes - 1, nmodes - 1)
+        fc = self.get_frequency(kmn)
+        lc = 2 * np.pi / kmn
+        fc_list = []
         for m in range(nmodes):
             for n in range(nmodes):
-                kmn = np.sqrt((m * np.pi / self.a) ** 2 + (n * np.pi / self.b) ** 2)
-                # print(kmn)
-                fmn = kmn / 2 / np.pi / np.sqrt(mu_0 * self.mu_r * epsilon_0 * self.epsilon_r)
-                if fmn == 0:
+                if fc[m, n] == 0:
                     continue
-                lmn = 2 * np.pi / kmn
-                row = ['{}{}'.format(m, n), eng_notation(fmn, unit='Hz'), eng_notation(lmn, unit='m'), fmn]
-                fc.append(row)
-        return fc
+                fc_list.append(['{}{}'.format(m, n), eng_notation(fc[m, n], unit='Hz'), eng_notation(lc[m, n], unit='m'), fc[m, n]])
+        return fc_list
+
+
+def format_modes(modes):
+    """Text rows of a mode table, formatting is only done here."""
+    return ['{}{}{} {} {}'.format(row['kind'], row['m'], row['n'], eng_notation(row['fc'], unit='Hz'),
+                                  eng_notation(row['lc'], unit='m')) for row in modes]
 
 
 # -----------------
 if __name__ == "__main__":
-    if (len(sys.argv) == 4):
+    if (len(sys.argv) == 5 and sys.argv[3] in ['--below', '--lowest']):
+        wg = WaveGuide(float(sys.argv[1]), float(sys.argv[2]))
+        if sys.argv[3] == '--below':
+            modes = wg.get_modes_below(float(sys.argv[4]))
+        else:
+            modes = wg.get_lowest_modes(int(sys.argv[4]))
+        print('\n'.join(format_modes(modes)))
+
+    elif (len(sys.argv) == 4):
         wg = WaveGuide(float(sys.argv[1]), float(sys.argv[2]))
         results = wg.get_fc(int(sys.argv[3]))
         results.sort(key=lambda row: row[3])  # sort list of list third column
@@ -61,4 +137,5 @@ if __name__ == "__main__":
 
     else:
         print(
-            'Please provide long side (a) along x axis, short side (b) along y axis in meters and number of desired modes.')
+            'Please provide long side (a) along x axis, short side (b) along y axis in meters and number of desired modes,\n'
+            'or --below followed by a maximum frequency in Hz, or --lowest followed by a number of modes.')